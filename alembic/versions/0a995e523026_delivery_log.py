@@ -0,0 +1,40 @@
+"""Delivery log
+
+Revision ID: 0a995e523026
+Revises: 8e7cca2fcc0d
+Create Date: 2026-10-18 19:42:11.508331
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0a995e523026'
+down_revision: Union[str, None] = '8e7cca2fcc0d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('delivery_cursors',
+    sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('last_seq', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_table('delivery_log',
+    sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('seq', sa.BigInteger(), autoincrement=False, nullable=False),
+    sa.Column('event', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('user_id', 'seq')
+    )
+    op.create_index('ix_delivery_log_created_at', 'delivery_log', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_delivery_log_created_at', table_name='delivery_log')
+    op.drop_table('delivery_log')
+    op.drop_table('delivery_cursors')
@@ -0,0 +1,43 @@
+"""SLA histogram log-linear buckets
+
+Revision ID: 2a2eee1ea881
+Revises: ac1fe3c0c848
+Create Date: 2026-10-19 00:02:18.407913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2a2eee1ea881'
+down_revision: Union[str, None] = 'ac1fe3c0c848'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Old buckets were floor(log2(seconds)), with everything under a second in
+# bucket 0. Each one moves to the new bucket (2^-6 s base, 8 per octave)
+# holding its old midpoint 2^(b+0.5); the new numbers are all above 31, so
+# nothing collides. Run `python -m app.core.ticket_stats` afterwards to
+# recount at full resolution.
+OLD_BUCKETS = 32
+
+
+NEW_MAX_BUCKET = 296
+
+
+def _new_bucket(old: int) -> int:
+    return min(int((old + 0.5 + 6) * 8) + 1, NEW_MAX_BUCKET)
+
+
+def upgrade() -> None:
+    mapping = " ".join(f"WHEN {old} THEN {_new_bucket(old)}" for old in range(OLD_BUCKETS))
+    op.execute(f"UPDATE sla_histogram SET bucket = CASE bucket {mapping} ELSE bucket END")
+
+
+def downgrade() -> None:
+    # Several new buckets fold into one old bucket, so recount instead:
+    # run `python -m app.core.ticket_stats` on the old code.
+    op.execute("DELETE FROM sla_histogram")
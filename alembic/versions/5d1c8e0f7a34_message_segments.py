@@ -0,0 +1,53 @@
+"""Message archive segments
+
+Revision ID: 5d1c8e0f7a34
+Revises: 0a995e523026
+Create Date: 2026-10-18 21:05:37.114562
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d1c8e0f7a34'
+down_revision: Union[str, None] = '0a995e523026'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('message_segments',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('ticket_id', sa.Integer(), nullable=True),
+    sa.Column('user_low', sa.Integer(), nullable=True),
+    sa.Column('user_high', sa.Integer(), nullable=True),
+    sa.Column('first_id', sa.Integer(), nullable=False),
+    sa.Column('last_id', sa.Integer(), nullable=False),
+    sa.Column('first_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('last_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('data', sa.LargeBinary().with_variant(mysql.LONGBLOB(), 'mysql'), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_message_segments_ticket_id_last_id', 'message_segments', ['ticket_id', 'last_id'], unique=False)
+    op.create_index('ix_message_segments_user_low_last_id', 'message_segments', ['user_low', 'last_id'], unique=False)
+    op.create_index('ix_message_segments_user_high_last_id', 'message_segments', ['user_high', 'last_id'], unique=False)
+    op.create_table('message_segment_users',
+    sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('segment_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['segment_id'], ['message_segments.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'segment_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('message_segment_users')
+    op.drop_index('ix_message_segments_user_high_last_id', table_name='message_segments')
+    op.drop_index('ix_message_segments_user_low_last_id', table_name='message_segments')
+    op.drop_index('ix_message_segments_ticket_id_last_id', table_name='message_segments')
+    op.drop_table('message_segments')
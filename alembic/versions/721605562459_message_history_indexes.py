@@ -0,0 +1,32 @@
+"""Message history indexes
+
+Revision ID: 721605562459
+Revises: bd57d24e8052
+Create Date: 2026-10-18 10:04:17.532904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '721605562459'
+down_revision: Union[str, None] = 'bd57d24e8052'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_messages_ticket_id_id', 'messages', ['ticket_id', 'id'], unique=False)
+    op.create_index('ix_messages_sender_id_receiver_id_id', 'messages', ['sender_id', 'receiver_id', 'id'], unique=False)
+    op.create_index('ix_messages_sender_id_id', 'messages', ['sender_id', 'id'], unique=False)
+    op.create_index('ix_messages_receiver_id_id', 'messages', ['receiver_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_receiver_id_id', table_name='messages')
+    op.drop_index('ix_messages_sender_id_id', table_name='messages')
+    op.drop_index('ix_messages_sender_id_receiver_id_id', table_name='messages')
+    op.drop_index('ix_messages_ticket_id_id', table_name='messages')
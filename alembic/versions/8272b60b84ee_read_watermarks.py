@@ -0,0 +1,38 @@
+"""Read watermarks
+
+Revision ID: 8272b60b84ee
+Revises: 721605562459
+Create Date: 2026-10-18 11:26:50.270318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8272b60b84ee'
+down_revision: Union[str, None] = '721605562459'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('read_watermarks',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('conversation', sa.String(length=40), nullable=False),
+    sa.Column('last_read_id', sa.Integer(), nullable=False),
+    sa.Column('unread_count', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'conversation', name='uq_read_watermarks_user_id_conversation')
+    )
+    op.create_index(op.f('ix_read_watermarks_id'), 'read_watermarks', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_read_watermarks_id'), table_name='read_watermarks')
+    op.drop_table('read_watermarks')
@@ -0,0 +1,43 @@
+"""Ticket queue stats
+
+Revision ID: 8e7cca2fcc0d
+Revises: b99e66dda525
+Create Date: 2026-10-18 16:08:33.902716
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e7cca2fcc0d'
+down_revision: Union[str, None] = 'b99e66dda525'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('tickets', sa.Column('first_response_at', sa.DateTime(timezone=True), nullable=True))
+    op.create_table('ticket_queue_counts',
+    sa.Column('assignee_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('priority', sa.String(length=20), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('assignee_id', 'priority', 'status')
+    )
+    op.create_table('sla_histogram',
+    sa.Column('metric', sa.String(length=20), nullable=False),
+    sa.Column('priority', sa.String(length=20), nullable=False),
+    sa.Column('bucket', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('metric', 'priority', 'bucket')
+    )
+    # Populate with: python -m app.core.ticket_stats
+
+
+def downgrade() -> None:
+    op.drop_table('sla_histogram')
+    op.drop_table('ticket_queue_counts')
+    op.drop_column('tickets', 'first_response_at')
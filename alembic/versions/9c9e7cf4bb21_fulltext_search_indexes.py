@@ -0,0 +1,33 @@
+"""Fulltext search indexes
+
+Revision ID: 9c9e7cf4bb21
+Revises: 8272b60b84ee
+Create Date: 2026-10-18 13:40:05.611842
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c9e7cf4bb21'
+down_revision: Union[str, None] = '8272b60b84ee'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # FULLTEXT is MySQL only; other databases use the embedded FTS5 index.
+    if op.get_bind().dialect.name != 'mysql':
+        return
+    op.create_index('ft_messages_content', 'messages', ['content'], unique=False, mysql_prefix='FULLTEXT')
+    op.create_index('ft_tickets_title_description', 'tickets', ['title', 'description'], unique=False, mysql_prefix='FULLTEXT')
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'mysql':
+        return
+    op.drop_index('ft_tickets_title_description', table_name='tickets')
+    op.drop_index('ft_messages_content', table_name='messages')
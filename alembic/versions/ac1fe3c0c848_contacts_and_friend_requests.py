@@ -0,0 +1,54 @@
+"""Contacts and friend requests
+
+Revision ID: ac1fe3c0c848
+Revises: 5d1c8e0f7a34
+Create Date: 2026-10-18 23:14:52.630417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ac1fe3c0c848'
+down_revision: Union[str, None] = '5d1c8e0f7a34'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('friend_requests',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('sender_id', sa.Integer(), nullable=False),
+    sa.Column('receiver_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['receiver_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['sender_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_friend_requests_id'), 'friend_requests', ['id'], unique=False)
+    op.create_table('user_contacts',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user1_id', sa.Integer(), nullable=False),
+    sa.Column('user2_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.ForeignKeyConstraint(['user1_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['user2_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_user_contacts_id'), 'user_contacts', ['id'], unique=False)
+    op.create_index(op.f('ix_user_contacts_user1_id'), 'user_contacts', ['user1_id'], unique=False)
+    op.create_index(op.f('ix_user_contacts_user2_id'), 'user_contacts', ['user2_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_user_contacts_user2_id'), table_name='user_contacts')
+    op.drop_index(op.f('ix_user_contacts_user1_id'), table_name='user_contacts')
+    op.drop_index(op.f('ix_user_contacts_id'), table_name='user_contacts')
+    op.drop_table('user_contacts')
+    op.drop_index(op.f('ix_friend_requests_id'), table_name='friend_requests')
+    op.drop_table('friend_requests')
@@ -0,0 +1,32 @@
+"""Ticket list indexes
+
+Revision ID: b99e66dda525
+Revises: 9c9e7cf4bb21
+Create Date: 2026-10-18 14:52:19.084417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b99e66dda525'
+down_revision: Union[str, None] = '9c9e7cf4bb21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_tickets_status_priority_created_at', 'tickets', ['status', 'priority', 'created_at'], unique=False)
+    op.create_index('ix_tickets_assignee_id_status', 'tickets', ['assignee_id', 'status'], unique=False)
+    op.create_index('ix_tickets_creator_id_created_at', 'tickets', ['creator_id', 'created_at'], unique=False)
+    op.create_index('ix_tickets_created_at', 'tickets', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tickets_created_at', table_name='tickets')
+    op.drop_index('ix_tickets_creator_id_created_at', table_name='tickets')
+    op.drop_index('ix_tickets_assignee_id_status', table_name='tickets')
+    op.drop_index('ix_tickets_status_priority_created_at', table_name='tickets')
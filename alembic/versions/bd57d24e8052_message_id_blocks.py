@@ -0,0 +1,31 @@
+"""Message id blocks
+
+Revision ID: bd57d24e8052
+Revises: 10eaeda7809b
+Create Date: 2026-10-18 09:12:41.118230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'bd57d24e8052'
+down_revision: Union[str, None] = '10eaeda7809b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('id_blocks',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('next_id', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.execute("INSERT INTO id_blocks (name, next_id) SELECT 'messages', COALESCE(MAX(id), 0) + 1 FROM messages")
+
+
+def downgrade() -> None:
+    op.drop_table('id_blocks')
@@ -0,0 +1,227 @@
+import json
+import logging
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, case, delete, insert, or_, select
+from sqlalchemy.orm import Session
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.search import search_index
+from app.models.archive import MessageSegment, MessageSegmentUser
+from app.models.message import Message
+from app.models.ticket import Ticket, TicketStatus
+
+# Hot/cold tiering of the messages table. An archival pass (run this module,
+# e.g. nightly from cron) moves the messages of tickets closed more than
+# ARCHIVE_TICKET_AFTER_DAYS ago, and DMs older than ARCHIVE_DM_AFTER_DAYS, out
+# of `messages` into message_segments: runs of up to ARCHIVE_SEGMENT_ROWS
+# messages of one conversation, zlib-compressed and append-only. The hot
+# table and its indexes then only hold live conversations.
+#
+# History reads merge both tiers. Segments are visited in id order through
+# their index columns and decompressed only while they can still hold
+# messages of the page being served, so reading recent history costs one
+# extra index lookup. Decoded segments are cached, as they never change.
+#
+# Search only covers the hot table: archived messages are taken out of the
+# search index as they are moved.
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("id", "sender_id", "receiver_id", "ticket_id", "content", "timestamp", "read")
+COLUMNS = [getattr(Message, field) for field in FIELDS]
+INDEX_PAGE = 32  # segment index rows fetched at a time while merging
+
+_segments = TTLCache("message_segments", settings.ARCHIVE_CACHE_SEGMENTS, settings.CACHE_TTL_SECONDS)
+
+
+def encode_segment(rows: List[dict]) -> bytes:
+    values = [[row[field] for field in FIELDS] for row in rows]
+    for value in values:
+        value[5] = value[5].isoformat() if value[5] else None
+    return zlib.compress(json.dumps(values, separators=(",", ":")).encode(), 6)
+
+
+def decode_segment(data: bytes) -> List[dict]:
+    rows = [dict(zip(FIELDS, values)) for values in json.loads(zlib.decompress(data))]
+    for row in rows:
+        if row["timestamp"]:
+            row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+    return rows
+
+
+# --- scopes -------------------------------------------------------------
+# A scope is the segment filters for a history view plus a test for the rows
+# of a matching segment that belong to it.
+
+Scope = Tuple[list, Optional[Callable[[dict], bool]]]
+
+
+def ticket_scope(ticket_id: int) -> Scope:
+    return [MessageSegment.ticket_id == ticket_id], None
+
+
+def user_scope(user_id: int, with_user_id: Optional[int] = None) -> Scope:
+    if with_user_id is None:
+        # Like the hot query: DMs either way plus ticket messages they sent.
+        segments = select(MessageSegmentUser.segment_id).where(MessageSegmentUser.user_id == user_id)
+        return [MessageSegment.id.in_(segments)], lambda row: (
+            row["sender_id"] == user_id or row["receiver_id"] == user_id
+        )
+    low, high = sorted((user_id, with_user_id))
+    return [MessageSegment.user_low == low, MessageSegment.user_high == high], None
+
+
+# --- archiving ----------------------------------------------------------
+
+def _move(db: Session, rows: List[dict], **owner) -> int:
+    # Deletes the rows (id ordered) from the hot table and writes them as one
+    # segment, in one transaction. If another archiver already moved some of
+    # them, nothing is written.
+    ids = [row["id"] for row in rows]
+    if db.execute(delete(Message).where(Message.id.in_(ids))).rowcount != len(ids):
+        db.rollback()
+        return 0
+    segment = MessageSegment(
+        **owner, first_id=ids[0], last_id=ids[-1], count=len(rows),
+        first_at=rows[0]["timestamp"], last_at=rows[-1]["timestamp"], data=encode_segment(rows),
+    )
+    db.add(segment)
+    db.flush()
+    users = {row["sender_id"] for row in rows} | {row["receiver_id"] for row in rows if row["receiver_id"]}
+    db.execute(insert(MessageSegmentUser), [{"user_id": user_id, "segment_id": segment.id} for user_id in users])
+    db.commit()
+    try:
+        search_index.remove_messages(ids)
+    except Exception:
+        # Stale hits point at ids that are gone; a rebuild drops them.
+        logger.exception("failed to remove %d archived messages from the search index", len(ids))
+    return len(rows)
+
+
+def _archive_conversation(db: Session, filters: list, **owner) -> int:
+    moved = 0
+    while True:
+        rows = [dict(zip(FIELDS, row)) for row in db.query(*COLUMNS).filter(*filters).order_by(
+            Message.id
+        ).limit(settings.ARCHIVE_SEGMENT_ROWS).all()]
+        if not rows:
+            return moved
+        count = _move(db, rows, **owner)
+        if not count:
+            return moved
+        moved += count
+
+
+def archive_tickets(db: Session, older_than: timedelta, max_tickets: int) -> Tuple[int, int]:
+    cutoff = datetime.now(timezone.utc) - older_than
+    ticket_ids = [ticket_id for (ticket_id,) in db.query(Ticket.id).filter(
+        Ticket.status == TicketStatus.CLOSED, Ticket.closed_at < cutoff,
+        db.query(Message.id).filter(Message.ticket_id == Ticket.id).exists(),
+    ).order_by(Ticket.closed_at).limit(max_tickets).all()]
+    db.rollback()
+    moved = sum(
+        _archive_conversation(db, [Message.ticket_id == ticket_id], ticket_id=ticket_id)
+        for ticket_id in ticket_ids
+    )
+    return len(ticket_ids), moved
+
+
+def archive_dms(db: Session, older_than: timedelta, max_conversations: int) -> Tuple[int, int]:
+    cutoff = datetime.now(timezone.utc) - older_than
+    low = case((Message.sender_id < Message.receiver_id, Message.sender_id), else_=Message.receiver_id)
+    high = case((Message.sender_id < Message.receiver_id, Message.receiver_id), else_=Message.sender_id)
+    old_dm = [Message.ticket_id.is_(None), Message.receiver_id.isnot(None), Message.timestamp < cutoff]
+    pairs = db.query(low, high).filter(*old_dm).distinct().limit(max_conversations).all()
+    db.rollback()
+    moved = 0
+    for a, b in pairs:
+        moved += _archive_conversation(db, old_dm + [or_(
+            and_(Message.sender_id == a, Message.receiver_id == b),
+            and_(Message.sender_id == b, Message.receiver_id == a),
+        )], user_low=a, user_high=b)
+    return len(pairs), moved
+
+
+def run(db: Session) -> dict:
+    tickets, ticket_messages = archive_tickets(
+        db, timedelta(days=settings.ARCHIVE_TICKET_AFTER_DAYS), settings.ARCHIVE_MAX_CONVERSATIONS
+    )
+    pairs, dm_messages = archive_dms(
+        db, timedelta(days=settings.ARCHIVE_DM_AFTER_DAYS), settings.ARCHIVE_MAX_CONVERSATIONS
+    )
+    return {"tickets": tickets, "ticket_messages": ticket_messages, "dm_pairs": pairs, "dm_messages": dm_messages}
+
+
+# --- reading ------------------------------------------------------------
+
+def _segment_rows(db: Session, segment_id: int) -> List[dict]:
+    return _segments.get_or_load(segment_id, lambda key: decode_segment(
+        db.query(MessageSegment.data).filter(MessageSegment.id == key).scalar()
+    ))
+
+
+def _segment_index(db: Session, filters: list, ascending: bool) -> Iterator[tuple]:
+    order = (MessageSegment.first_id.asc(),) if ascending else (MessageSegment.last_id.desc(),)
+    offset = 0
+    while True:
+        page = db.query(MessageSegment.id, MessageSegment.first_id, MessageSegment.last_id).filter(
+            *filters
+        ).order_by(*order, MessageSegment.id).offset(offset).limit(INDEX_PAGE).all()
+        yield from page
+        if len(page) < INDEX_PAGE:
+            return
+        offset += INDEX_PAGE
+
+
+def merge_page(db: Session, scope: Scope, page: list, before_id: Optional[int], after_id: Optional[int],
+               limit: int, make: Callable[[dict], dict]) -> List[dict]:
+    # `page` is what the hot table returned for this cursor, as dicts in page
+    # order (newest first unless after_id is given). Adds archived messages
+    # that belong on the page, built with `make`, and returns it in the same
+    # order.
+    ascending = after_id is not None
+    filters, keep = scope
+    if before_id is not None:
+        filters = filters + [MessageSegment.first_id < before_id]
+    if after_id is not None:
+        filters = filters + [MessageSegment.last_id > after_id]
+    for segment_id, first_id, last_id in _segment_index(db, filters, ascending):
+        if len(page) >= limit:
+            bound = page[limit - 1]["id"]
+            if (first_id > bound) if ascending else (last_id < bound):
+                break
+        page = page + [
+            make(row) for row in _segment_rows(db, segment_id)
+            if (keep is None or keep(row))
+            and (before_id is None or row["id"] < before_id)
+            and (after_id is None or row["id"] > after_id)
+        ]
+        page.sort(key=lambda message: message["id"], reverse=not ascending)
+        del page[limit:]
+    return page
+
+
+def iter_rows(scope: Scope) -> Iterator[tuple]:
+    # Every archived row of the scope in id order, as FIELDS tuples (for exports).
+    filters, keep = scope
+    db = SessionLocal()
+    try:
+        for segment_id, _, _ in _segment_index(db, filters, True):
+            for row in _segment_rows(db, segment_id):
+                if keep is None or keep(row):
+                    yield tuple(row[field] for field in FIELDS)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    session = SessionLocal()
+    try:
+        print("archived", run(session))
+    finally:
+        session.close()
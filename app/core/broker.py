@@ -0,0 +1,478 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[str, Any], Awaitable[None]]
+Method = Callable[[Any], Awaitable[Any]]
+
+CALL_TIMEOUT = 10  # seconds to wait for the relay to answer a call
+CALL_ATTEMPTS = 3  # a call is retried on the next relay if its relay goes away
+WRITE_BUFFER_LIMIT = 4 * 1024 * 1024  # bytes queued to a peer that isn't reading before it is dropped
+
+
+class StateStore:
+    # Namespaced key/value + set store. Every mutation is expressed as an op
+    # so it can be replayed on the other workers.
+    def __init__(self):
+        self.data: Dict[str, Dict[str, Any]] = {}
+
+    def apply(self, op: list):
+        kind, ns, key = op[0], op[1], str(op[2])
+        bucket = self.data.setdefault(ns, {})
+        if kind == "set":
+            bucket[key] = op[3]
+        elif kind == "del":
+            bucket.pop(key, None)
+        elif kind == "incr":
+            value = bucket.get(key, 0) + op[3]
+            if value <= 0:
+                bucket.pop(key, None)
+            else:
+                bucket[key] = value
+        elif kind == "sadd":
+            bucket.setdefault(key, set()).add(op[3])
+        elif kind == "srem":
+            members = bucket.get(key)
+            if members is not None:
+                members.discard(op[3])
+                if not members:
+                    del bucket[key]
+        # "release" only changes who vouches for a member, see Contributions.
+        if not bucket:
+            self.data.pop(ns, None)
+
+    def get(self, ns: str, key, default=None):
+        return self.data.get(ns, {}).get(str(key), default)
+
+    def dump_ops(self) -> List[list]:
+        ops = []
+        for ns, bucket in self.data.items():
+            for key, value in bucket.items():
+                if isinstance(value, set):
+                    ops.extend(["sadd", ns, key, member] for member in value)
+                else:
+                    ops.append(["set", ns, key, value])
+        return ops
+
+
+class Contributions:
+    # The part of the shared state one worker is responsible for: values it
+    # was the last to set, its net increments and the set members it added.
+    # It is what the worker re-sends to a new relay, and what the relay
+    # takes back out when the worker disconnects.
+    def __init__(self):
+        self.values: Dict[tuple, Any] = {}
+        self.counts: Dict[tuple, int] = {}
+        self.members: Dict[tuple, Set] = {}
+
+    def record(self, op: list):
+        # An op this worker made.
+        kind, key = op[0], (op[1], str(op[2]))
+        if kind == "set":
+            self.values[key] = op[3]
+        elif kind == "del":
+            self._drop(key)
+        elif kind == "incr":
+            count = self.counts.get(key, 0) + op[3]
+            if count:
+                self.counts[key] = count
+            else:
+                self.counts.pop(key, None)
+        elif kind == "sadd":
+            self.members.setdefault(key, set()).add(op[3])
+        elif kind in ("srem", "release"):
+            self._discard(key, op[3])
+
+    def forget(self, op: list):
+        # An op another worker made, which overrides ours for that key.
+        kind, key = op[0], (op[1], str(op[2]))
+        if kind == "set":
+            self.values.pop(key, None)
+        elif kind == "del":
+            self._drop(key)
+        elif kind == "srem":
+            self._discard(key, op[3])
+
+    def holds(self, key: tuple, member) -> bool:
+        return member in self.members.get(key, ())
+
+    def _drop(self, key: tuple):
+        self.values.pop(key, None)
+        self.counts.pop(key, None)
+        self.members.pop(key, None)
+
+    def _discard(self, key: tuple, member):
+        members = self.members.get(key)
+        if members is not None:
+            members.discard(member)
+            if not members:
+                del self.members[key]
+
+    def ops(self) -> List[list]:
+        ops = [["set", ns, key, value] for (ns, key), value in self.values.items()]
+        ops.extend(["incr", ns, key, count] for (ns, key), count in self.counts.items())
+        for (ns, key), members in self.members.items():
+            ops.extend(["sadd", ns, key, member] for member in members)
+        return ops
+
+
+class Broker:
+    """Fan-out of channel messages and shared state between workers."""
+
+    def __init__(self):
+        self.state = StateStore()
+        self.handler: Optional[Handler] = None
+        self.methods: Dict[str, Method] = {}
+
+    def set_handler(self, handler: Handler):
+        self.handler = handler
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def subscribe(self, channel: str):
+        pass
+
+    async def unsubscribe(self, channel: str):
+        pass
+
+    async def publish(self, channel: str, payload: Any):
+        raise NotImplementedError
+
+    def _mutate(self, op: list):
+        self.state.apply(op)
+
+    # --- calls --------------------------------------------------------
+    # A call runs a registered method in exactly one place for all workers:
+    # on the worker hosting the relay with the unix backend, locally
+    # otherwise. Arguments and results must be JSON-compatible.
+
+    def register(self, method: str, fn: Method):
+        self.methods[method] = fn
+
+    async def call(self, method: str, args: Any = None) -> Any:
+        return await self.methods[method](args)
+
+    async def _dispatch(self, channel: str, payload: Any):
+        if self.handler is None:
+            return
+        try:
+            await self.handler(channel, payload)
+        except Exception:
+            logger.exception("broker handler failed for %s", channel)
+
+    # --- shared state -------------------------------------------------
+
+    def get(self, ns: str, key, default=None):
+        return self.state.get(ns, key, default)
+
+    def set(self, ns: str, key, value):
+        self._mutate(["set", ns, str(key), value])
+
+    def delete(self, ns: str, key):
+        self._mutate(["del", ns, str(key)])
+
+    def incr(self, ns: str, key, delta: int = 1) -> int:
+        self._mutate(["incr", ns, str(key), delta])
+        return self.state.get(ns, key, 0)
+
+    def sadd(self, ns: str, key, member):
+        self._mutate(["sadd", ns, str(key), member])
+
+    def srem(self, ns: str, key, member) -> int:
+        self._mutate(["srem", ns, str(key), member])
+        return len(self.state.get(ns, key, ()))
+
+    def release(self, ns: str, key, member):
+        # Stops vouching for a member this worker added without removing it,
+        # for members other workers still hold; the relay removes it when
+        # the last holder disconnects.
+        self._mutate(["release", ns, str(key), member])
+
+    def smembers(self, ns: str, key) -> Set:
+        return set(self.state.get(ns, key, ()))
+
+    def items(self, ns: str) -> List[tuple]:
+        return list(self.state.data.get(ns, {}).items())
+
+    def leads(self) -> bool:
+        # True on exactly one worker, for housekeeping that must run once.
+        return True
+
+
+class InProcessBroker(Broker):
+    async def publish(self, channel: str, payload: Any):
+        await self._dispatch(channel, payload)
+
+
+class UnixSocketBroker(Broker):
+    # Every worker connects to a relay listening on a Unix socket. The first
+    # worker to bind the path hosts the relay; the others reconnect and take
+    # over if it goes away. Frames are newline-delimited JSON.
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.channels: Set[str] = set()
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.relay: Optional["_Relay"] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.task: Optional[asyncio.Task] = None
+        self.connected = asyncio.Event()
+        self.calls: Dict[int, asyncio.Future] = {}
+        self.last_call = 0
+        self.own = Contributions()
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self.connected.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            logger.warning("broker relay at %s not reachable yet", self.path)
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+        if self.writer:
+            self.writer.close()
+        if self.server:
+            self.server.close()
+            self.relay.close()
+            await self.server.wait_closed()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def subscribe(self, channel: str):
+        if channel not in self.channels:
+            self.channels.add(channel)
+            self._send({"t": "sub", "c": channel})
+
+    async def unsubscribe(self, channel: str):
+        if channel in self.channels:
+            self.channels.discard(channel)
+            self._send({"t": "unsub", "c": channel})
+
+    async def publish(self, channel: str, payload: Any):
+        # Local subscribers are served directly, the relay skips the origin.
+        if channel in self.channels:
+            await self._dispatch(channel, payload)
+        self._send({"t": "pub", "c": channel, "p": payload})
+
+    def _mutate(self, op: list):
+        self.state.apply(op)
+        self.own.record(op)
+        self._send({"t": "op", "op": op})
+
+    def leads(self) -> bool:
+        return self.server is not None
+
+    async def call(self, method: str, args: Any = None) -> Any:
+        for _ in range(CALL_ATTEMPTS):
+            await asyncio.wait_for(self.connected.wait(), timeout=CALL_TIMEOUT)
+            self.last_call += 1
+            call_id = self.last_call
+            future = self.calls[call_id] = asyncio.get_running_loop().create_future()
+            self._send({"t": "call", "id": call_id, "m": method, "a": args})
+            try:
+                reply = await asyncio.wait_for(future, timeout=CALL_TIMEOUT)
+            except ConnectionError:
+                continue
+            finally:
+                self.calls.pop(call_id, None)
+            if "e" in reply:
+                raise RuntimeError(f"broker call {method} failed: {reply['e']}")
+            return reply["r"]
+        raise ConnectionError(f"broker call {method}: relay unavailable")
+
+    def _send(self, frame: dict):
+        if self.writer is None or self.writer.is_closing():
+            return
+        if self.writer.transport.get_write_buffer_size() > WRITE_BUFFER_LIMIT:
+            # The relay isn't keeping up; reconnecting resyncs the state.
+            logger.warning("broker relay at %s is not reading, reconnecting", self.path)
+            self.writer.close()
+            return
+        self.writer.write(json.dumps(frame).encode() + b"\n")
+
+    async def _become_relay(self) -> bool:
+        if os.path.exists(self.path):
+            try:
+                _, writer = await asyncio.open_unix_connection(self.path)
+                writer.close()
+                return False
+            except (ConnectionRefusedError, FileNotFoundError):
+                try:
+                    os.unlink(self.path)
+                except FileNotFoundError:
+                    pass
+        self.relay = _Relay(self.methods)
+        try:
+            self.server = await asyncio.start_unix_server(self.relay.handle, path=self.path)
+        except OSError:
+            self.relay = None
+            return False
+        logger.info("broker relay listening on %s", self.path)
+        return True
+
+    async def _run(self):
+        delay = 0.1
+        while True:
+            try:
+                if self.server is None:
+                    await self._become_relay()
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 2.0)
+                continue
+            delay = 0.1
+            self.writer = writer
+            for channel in self.channels:
+                self._send({"t": "sub", "c": channel})
+            # The relay may be new, so hand it this worker's share of the
+            # state; the snapshot it sends back has everyone else's.
+            for op in self.own.ops():
+                self._send({"t": "op", "op": op})
+            self.connected.set()
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    frame = json.loads(line)
+                    if frame["t"] == "pub":
+                        await self._dispatch(frame["c"], frame["p"])
+                    elif frame["t"] == "op":
+                        self.state.apply(frame["op"])
+                        self.own.forget(frame["op"])
+                    elif frame["t"] == "reply":
+                        future = self.calls.get(frame["id"])
+                        if future is not None and not future.done():
+                            future.set_result(frame)
+                    elif frame["t"] == "snapshot":
+                        # Whatever the previous relay had from workers that
+                        # are gone is dropped here.
+                        self.state = StateStore()
+                        for op in frame["ops"] + self.own.ops():
+                            self.state.apply(op)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                self.connected.clear()
+                self.writer = None
+                writer.close()
+                # Calls in flight are retried once connected to a relay again.
+                for future in self.calls.values():
+                    if not future.done():
+                        future.set_exception(ConnectionError("broker relay went away"))
+
+
+class _Relay:
+    def __init__(self, methods: Dict[str, Method]):
+        self.state = StateStore()
+        self.clients: Dict[asyncio.StreamWriter, Set[str]] = {}
+        self.owned: Dict[asyncio.StreamWriter, Contributions] = {}
+        self.methods = methods
+        self.tasks: Set[asyncio.Task] = set()
+
+    def close(self):
+        for writer in list(self.clients):
+            writer.close()
+
+    def _write(self, writer: asyncio.StreamWriter, frame: dict):
+        if writer.is_closing():
+            return
+        if writer.transport.get_write_buffer_size() > WRITE_BUFFER_LIMIT:
+            # Dropping the peer bounds memory; it reconnects and resyncs.
+            logger.warning("broker peer is not reading, disconnecting it")
+            writer.close()
+            return
+        writer.write(json.dumps(frame).encode() + b"\n")
+
+    def _apply(self, writer: Optional[asyncio.StreamWriter], frame: dict):
+        # Applies an op from `writer` (None for the relay itself) and passes
+        # it on to every other worker.
+        op = frame["op"]
+        self.state.apply(op)
+        for client, owned in self.owned.items():
+            if client is writer:
+                owned.record(op)
+            else:
+                owned.forget(op)
+        for client in self.clients:
+            if client is not writer:
+                self._write(client, frame)
+
+    def _withdraw(self, writer: asyncio.StreamWriter):
+        # Takes a disconnected worker's share back out of the state, so
+        # presence and room membership of its sockets don't linger.
+        owned = self.owned.pop(writer)
+        others = list(self.owned.values())
+        for ns, key in owned.values:
+            self._apply(None, {"t": "op", "op": ["del", ns, key]})
+        for (ns, key), count in owned.counts.items():
+            self._apply(None, {"t": "op", "op": ["incr", ns, key, -count]})
+        for (ns, key), members in owned.members.items():
+            for member in members:
+                if not any(other.holds((ns, key), member) for other in others):
+                    self._apply(None, {"t": "op", "op": ["srem", ns, key, member]})
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.clients[writer] = set()
+        self.owned[writer] = Contributions()
+        self._write(writer, {"t": "snapshot", "ops": self.state.dump_ops()})
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                frame = json.loads(line)
+                kind = frame["t"]
+                if kind == "sub":
+                    self.clients[writer].add(frame["c"])
+                elif kind == "unsub":
+                    self.clients[writer].discard(frame["c"])
+                elif kind == "pub":
+                    for client, channels in self.clients.items():
+                        if client is not writer and frame["c"] in channels:
+                            self._write(client, frame)
+                elif kind == "op":
+                    self._apply(writer, frame)
+                elif kind == "call":
+                    task = asyncio.create_task(self._serve(writer, frame))
+                    self.tasks.add(task)
+                    task.add_done_callback(self.tasks.discard)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.clients.pop(writer, None)
+            self._withdraw(writer)
+            writer.close()
+
+    async def _serve(self, writer: asyncio.StreamWriter, frame: dict):
+        try:
+            reply = {"t": "reply", "id": frame["id"], "r": await self.methods[frame["m"]](frame["a"])}
+        except Exception as exc:
+            logger.exception("broker call %s failed", frame["m"])
+            reply = {"t": "reply", "id": frame["id"], "e": repr(exc)}
+        self._write(writer, reply)
+
+
+def create_broker() -> Broker:
+    if settings.BROKER_BACKEND == "unix":
+        return UnixSocketBroker(settings.BROKER_SOCKET_PATH)
+    if settings.BROKER_BACKEND == "memory":
+        return InProcessBroker()
+    raise ValueError(f"Unknown broker backend: {settings.BROKER_BACKEND}")
+
+
+broker = create_broker()
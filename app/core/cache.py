@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.metrics import Counter, Gauge
+from app.models.ticket import Ticket
+from app.models.user import User
+
+_MISSING = object()
+_caches = []
+
+
+class TTLCache:
+    # Bounded LRU with a per-entry time to live. Safe to share between the
+    # event loop and threadpool handlers.
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        _caches.append(self)
+
+    def get(self, key: Hashable, default=None):
+        with self.lock:
+            entry = self.entries.get(key, _MISSING)
+            if entry is not _MISSING and entry[1] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not _MISSING:
+                del self.entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else min(ttl, self.ttl)))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable[[Hashable], Any]):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader(key)
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    async def aget_or_load(self, key: Hashable, loader: Callable[[Hashable], Any]):
+        # Hits stay on the event loop; only misses go to the threadpool.
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = await run_in_threadpool(loader, key)
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def invalidate(self, key: Hashable):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+user_cache = TTLCache("users", settings.CACHE_MAXSIZE, settings.CACHE_TTL_SECONDS)
+ticket_cache = TTLCache("tickets", settings.CACHE_MAXSIZE, settings.CACHE_TTL_SECONDS)
+
+
+def _load_user(user_id: int) -> Optional[dict]:
+    db = SessionLocal()
+    try:
+        row = db.query(User.id, User.name, User.role, User.avatar).filter(User.id == user_id).first()
+        return {"id": row.id, "name": row.name, "role": row.role, "avatar": row.avatar} if row else None
+    finally:
+        db.close()
+
+
+def _load_ticket(ticket_id: int) -> Optional[dict]:
+    db = SessionLocal()
+    try:
+        row = db.query(Ticket.id, Ticket.title, Ticket.creator_id, Ticket.assignee_id).filter(Ticket.id == ticket_id).first()
+        if not row:
+            return None
+        return {"id": row.id, "title": row.title, "creator_id": row.creator_id, "assignee_id": row.assignee_id}
+    finally:
+        db.close()
+
+
+def get_user_display(user_id: int) -> Optional[dict]:
+    return user_cache.get_or_load(user_id, _load_user)
+
+
+def get_ticket_routing(ticket_id: int) -> Optional[dict]:
+    return ticket_cache.get_or_load(ticket_id, _load_ticket)
+
+
+async def aget_user_display(user_id: int) -> Optional[dict]:
+    return await user_cache.aget_or_load(user_id, _load_user)
+
+
+async def aget_ticket_routing(ticket_id: int) -> Optional[dict]:
+    return await ticket_cache.aget_or_load(ticket_id, _load_ticket)
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    return {cache.name: cache.stats() for cache in _caches}
+
+
+def _per_cache(field: str):
+    return lambda: {(cache.name,): getattr(cache, field) for cache in _caches}
+
+
+Counter("cache_hits_total", "Cache lookups served from memory.", ("cache",), callback=_per_cache("hits"))
+Counter("cache_misses_total", "Cache lookups that went to the loader.", ("cache",), callback=_per_cache("misses"))
+Counter("cache_evictions_total", "Entries evicted to stay under maxsize.", ("cache",), callback=_per_cache("evictions"))
+Gauge("cache_entries", "Entries currently cached.", ("cache",),
+      callback=lambda: {(cache.name,): len(cache.entries) for cache in _caches})
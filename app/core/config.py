@@ -5,5 +5,65 @@ class Settings(BaseSettings):
     SECRET_KEY: str = "supersecretkey"  # Change to a secure value in production
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
+    DB_POOL_SIZE: int = 10  # per worker process; size to (workers x pool_size) <= server max_connections
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 10  # seconds to wait for a connection before failing the request
+    DB_POOL_RECYCLE: int = 1800  # keep below the server's wait_timeout so idle connections are replaced, not pinged
+    DB_POOL_PRE_PING: bool = False
+    BROKER_BACKEND: str = "memory"  # "memory" (single worker) or "unix" (all workers on this host)
+    BROKER_SOCKET_PATH: str = "/tmp/supportchat-broker.sock"
+    MESSAGE_QUEUE_MAXSIZE: int = 10000
+    MESSAGE_BATCH_MAX_ROWS: int = 500
+    MESSAGE_FLUSH_INTERVAL_MS: int = 10  # how long a batch may wait to fill up; 0 writes whatever is queued
+    MESSAGE_ID_BLOCK_SIZE: int = 1000
+    WRITE_RETRY_ATTEMPTS: int = 5  # a failed message batch is retried this often (0.1s backoff, doubling) before dead-lettering
+    DEAD_LETTER_DIR: str = "data/dead_letter"  # rows that could not be written, as <queue>.jsonl
+    CACHE_MAXSIZE: int = 10000
+    CACHE_TTL_SECONDS: float = 300
+    TOKEN_CACHE_MAXSIZE: int = 50000
+    WS_SEND_QUEUE_SIZE: int = 256  # outbound frames a client may fall behind before the slow-consumer policy applies
+    WS_SLOW_CONSUMER_POLICY: str = "disconnect"  # "disconnect" or "drop"
+    WS_HEARTBEAT_INTERVAL_SECONDS: float = 30  # quiet structured clients are pinged this often
+    WS_IDLE_TIMEOUT_SECONDS: float = 75  # and reaped if nothing arrives for this long
+    # Token-bucket limits, per worker: *_RATE is tokens per second (0 turns the limit off), *_BURST the bucket size.
+    WS_USER_FRAME_RATE: float = 20  # messages and signaling frames from one user across their sockets; typing/presence are exempt
+    WS_USER_FRAME_BURST: int = 60
+    WS_TICKET_MESSAGE_RATE: float = 30  # chat messages into one ticket room, from everyone
+    WS_TICKET_MESSAGE_BURST: int = 90
+    WS_IP_CONNECT_RATE: float = 2  # new WebSocket connections from one IP
+    WS_IP_CONNECT_BURST: int = 30
+    WS_ACCEPT_RATE: float = 500  # new WebSocket connections per worker; excess handshakes are queued
+    WS_ACCEPT_BURST: int = 1000
+    WS_ACCEPT_MAX_WAIT_SECONDS: float = 5  # and refused if they would queue longer than this
+    MESSAGE_SEND_RATE: float = 5  # POST /api/messages/ per user
+    MESSAGE_SEND_BURST: int = 20
+    TICKET_CREATE_RATE: float = 0.2  # POST /api/tickets/ per user
+    TICKET_CREATE_BURST: int = 10
+    LOGIN_RATE: float = 0.5  # POST /api/auth/login per IP
+    LOGIN_BURST: int = 10
+    DELIVERY_QUEUE_MAXSIZE: int = 10000
+    DELIVERY_BATCH_MAX_ROWS: int = 500
+    DELIVERY_FLUSH_INTERVAL_MS: int = 2  # live user events wait at most this long for a batch to fill
+    DELIVERY_LOG_TTL_SECONDS: int = 24 * 3600
+    DELIVERY_LOG_MAX_PER_USER: int = 1000
+    DELIVERY_PRUNE_INTERVAL_SECONDS: int = 60
+    DELIVERY_SYNC_BATCH: int = 200  # entries per frame when replaying a gap
+    PRESENCE_FLUSH_MS: int = 250  # presence/typing changes are batched and sent at most this often
+    TYPING_TTL_SECONDS: float = 6  # a typing indicator clears itself if not refreshed
+    ICE_COALESCE_MS: int = 20  # trickle-ICE candidates for one peer arriving within this window share a frame
+    CALL_RING_TIMEOUT_SECONDS: int = 45  # unanswered calls are ended as missed after this long
+    WS_COALESCE_MAX_FRAMES: int = 64  # most queued events folded into one frame (structured protocols only)
+    IMAGE_WORKERS: int = 0  # 0 means one process per CPU
+    AVATAR_MAX_BYTES: int = 10 * 1024 * 1024
+    SEARCH_BACKEND: str = "auto"  # "mysql" (FULLTEXT), "fts5" (embedded SQLite index) or "auto"
+    SEARCH_INDEX_PATH: str = "data/search.db"
+    ARCHIVE_TICKET_AFTER_DAYS: int = 30  # messages of tickets closed this long ago move to the cold tier
+    ARCHIVE_DM_AFTER_DAYS: int = 180  # as do DMs older than this
+    ARCHIVE_SEGMENT_ROWS: int = 1000  # messages per compressed archive segment
+    ARCHIVE_MAX_CONVERSATIONS: int = 1000  # tickets (and DM pairs) archived per run
+    ARCHIVE_CACHE_SEGMENTS: int = 256  # decoded segments kept in memory per process
+    PASSWORD_HASH_WORKERS: int = 0  # 0 means one process per CPU
+    PASSWORD_HASH_MAX_CONCURRENCY: int = 0  # 0 means two jobs per worker process
+    METRICS_ENABLED: bool = True  # per-request HTTP timing middleware; /metrics is always served
 
 settings = Settings() 
\ No newline at end of file
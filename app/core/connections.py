@@ -0,0 +1,360 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict, List, Optional, Set, Tuple
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from app.core.config import settings
+from app.core.metrics import Counter, Gauge
+from app.core.protocol import LEGACY, EncodedEvent, Frame, Protocol, event, receive
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionStats:
+    def __init__(self):
+        self.opened = 0
+        self.closed = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.frames_coalesced = 0
+        self.send_errors = 0
+        self.evictions = 0
+        self.reaped = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "active": self.opened - self.closed,
+            "opened": self.opened,
+            "closed": self.closed,
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "frames_coalesced": self.frames_coalesced,
+            "send_errors": self.send_errors,
+            "evictions": self.evictions,
+            "reaped": self.reaped,
+        }
+
+
+stats = ConnectionStats()
+
+Gauge("ws_connections_active", "Open WebSocket connections in this worker.", callback=lambda: {(): stats.opened - stats.closed})
+Counter("ws_frames_sent_total", "Frames written to WebSocket clients.", callback=lambda: {(): stats.frames_sent})
+Counter("ws_frames_dropped_total", "Frames dropped because a client's send queue was full.", callback=lambda: {(): stats.frames_dropped})
+Counter("ws_frames_coalesced_total", "Events folded into a batch frame instead of sent alone.", callback=lambda: {(): stats.frames_coalesced})
+Counter("ws_send_errors_total", "WebSocket writes that failed.", callback=lambda: {(): stats.send_errors})
+Counter("ws_evictions_total", "Slow consumers disconnected.", callback=lambda: {(): stats.evictions})
+Counter("ws_reaped_total", "Idle or dead sockets closed by the heartbeat.", callback=lambda: {(): stats.reaped})
+
+# Closes started from synchronous code, kept referenced until they finish
+# so they can't be garbage-collected mid-flight.
+_closing: Set[asyncio.Task] = set()
+
+
+def _close_soon(conn: "Connection", code: int):
+    task = asyncio.create_task(conn.close(code=code))
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+
+class Connection:
+    # A WebSocket with its own bounded outbound queue. send() never waits, so
+    # fan-out to many sockets is just a loop of appends and one stalled
+    # client cannot hold up the others. Once a client falls
+    # WS_SEND_QUEUE_SIZE frames behind, new frames are dropped or the socket
+    # is closed, depending on WS_SLOW_CONSUMER_POLICY. For protocols that
+    # allow it, frames that pile up while a write is in flight go out
+    # together as one batch frame.
+    #
+    # Most sockets are idle most of the time, so the record is slotted and
+    # the queue and writer task only exist while there is something to send.
+    #
+    # While a bulk reply (a resync) is being streamed with send_wait(), live
+    # frames are held aside and queued after it, so a large reply to a slow
+    # client can't push live traffic over the slow-consumer limit.
+
+    __slots__ = (
+        "websocket", "protocol", "policy", "max_queue", "pending", "held", "writer", "drained",
+        "closed", "finished", "reaped", "reader", "user_id", "device", "channels", "last_seen",
+    )
+
+    def __init__(self, websocket: WebSocket, protocol: Protocol = LEGACY,
+                 max_queue: Optional[int] = None, policy: Optional[str] = None,
+                 user_id: Optional[int] = None, device: Optional[str] = None):
+        self.websocket = websocket
+        self.protocol = protocol
+        self.policy = policy or settings.WS_SLOW_CONSUMER_POLICY
+        self.max_queue = max_queue or settings.WS_SEND_QUEUE_SIZE
+        self.pending: Optional[deque] = None
+        self.held: Optional[List[Frame]] = None
+        self.writer: Optional[asyncio.Task] = None
+        self.drained: Optional[asyncio.Future] = None
+        self.closed = False
+        self.finished = False
+        self.reaped = False
+        self.reader: Optional[asyncio.Task] = None
+        self.user_id = user_id
+        self.device = device
+        self.channels: Tuple[str, ...] = ()
+        self.last_seen = time.monotonic()
+        stats.opened += 1
+
+    def _enqueue(self, payload: Frame):
+        if self.pending is None:
+            self.pending = deque()
+        self.pending.append(payload)
+        if self.writer is None:
+            self.writer = asyncio.create_task(self._write_loop())
+
+    def send(self, payload: Frame) -> bool:
+        if self.closed:
+            return False
+        queue = self.held if self.held is not None else self.pending
+        if queue is not None and len(queue) >= self.max_queue:
+            stats.frames_dropped += 1
+            if self.policy == "disconnect":
+                self.closed = True
+                stats.evictions += 1
+                logger.info("evicting slow websocket consumer (%d frames queued)", len(queue))
+                _close_soon(self, 1013)
+            return False
+        if self.held is not None:
+            self.held.append(payload)
+        else:
+            self._enqueue(payload)
+        return True
+
+    async def send_wait(self, payload: Frame) -> bool:
+        # Like send(), but waits for room instead of applying the slow
+        # consumer policy. For bulk replies the client asked for.
+        while not self.closed and self.pending is not None and len(self.pending) >= self.max_queue:
+            if self.drained is None:
+                self.drained = asyncio.get_running_loop().create_future()
+            await asyncio.shield(self.drained)
+        if self.closed:
+            return False
+        self._enqueue(payload)
+        return True
+
+    def hold(self):
+        # Live send()s are kept aside until release().
+        if self.held is None:
+            self.held = []
+
+    def release(self):
+        held, self.held = self.held, None
+        if held and not self.closed:
+            for payload in held:
+                self._enqueue(payload)
+
+    def _wake(self):
+        if self.drained is not None:
+            if not self.drained.done():
+                self.drained.set_result(None)
+            self.drained = None
+
+    async def _write_loop(self):
+        # Runs while frames are queued and exits once the queue is empty.
+        pending = self.pending
+        try:
+            while pending:
+                payload = pending.popleft()
+                if self.protocol.batching and pending:
+                    frames = [payload]
+                    while len(frames) < settings.WS_COALESCE_MAX_FRAMES and pending:
+                        frames.append(pending.popleft())
+                    stats.frames_coalesced += len(frames) - 1
+                    payload = self.protocol.batch(frames)
+                if isinstance(payload, bytes):
+                    await self.websocket.send_bytes(payload)
+                else:
+                    await self.websocket.send_text(payload)
+                stats.frames_sent += 1
+                self._wake()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            stats.send_errors += 1
+            self.closed = True
+        finally:
+            self.writer = None
+            self.pending = None
+            self._wake()
+
+    async def receive(self) -> Optional[dict]:
+        # Next decoded event from the client (None for frames that don't
+        # parse or are heartbeats). Raises WebSocketDisconnect when the client
+        # goes away or the reaper gives up on it.
+        self.reader = asyncio.current_task()
+        try:
+            incoming = await receive(self.websocket, self.protocol)
+        except asyncio.CancelledError:
+            if not self.reaped:
+                raise
+            self.reader.uncancel()
+            raise WebSocketDisconnect(1001)
+        finally:
+            self.reader = None
+        self.last_seen = time.monotonic()
+        if incoming is not None and incoming.get("type") in ("ping", "pong"):
+            if incoming["type"] == "ping":
+                self.send(self.protocol.encode(event("pong")))
+            return None
+        return incoming
+
+    def reap(self):
+        # Ends the handler's receive() with a WebSocketDisconnect, so its
+        # own cleanup runs; sockets nobody is reading are just closed.
+        if self.reaped or self.finished:
+            return
+        self.reaped = True
+        self.closed = True
+        stats.reaped += 1
+        if self.reader is not None:
+            self.reader.cancel()
+        else:
+            _close_soon(self, 1001)
+
+    async def close(self, code: int = 1000):
+        if self.finished:
+            return
+        self.finished = True
+        self.closed = True
+        if self.writer is not None:
+            self.writer.cancel()
+        self._wake()
+        stats.closed += 1
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
+class ConnectionRegistry:
+    # Local sockets of this worker. Every connection is in `connections`;
+    # `users` indexes them by user and `channels` by the broker channel they
+    # receive from (user:, ticket:, signal:). Membership is set based, so
+    # joining and leaving are O(1) however many sockets share a channel.
+    #
+    # A heartbeat sweeps all connections every WS_HEARTBEAT_INTERVAL_SECONDS.
+    # Structured clients that have been quiet for a whole interval are sent
+    # a "ping" event and must answer (any frame will do) within
+    # WS_IDLE_TIMEOUT_SECONDS, or are reaped with the rest of the dead in
+    # one pass. Legacy clients can't answer application pings; uvicorn's
+    # protocol-level ping (--ws-ping-interval) closes their half-open
+    # sockets instead. Sockets already closed by the slow-consumer policy or
+    # a failed write are reaped too.
+
+    def __init__(self, interval: float, idle_timeout: float):
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.connections: Set[Connection] = set()
+        self.users: Dict[int, Set[Connection]] = {}
+        self.channels: Dict[str, Set[Connection]] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.sweeps = 0
+        self.pings = 0
+
+    def add(self, conn: Connection):
+        self.connections.add(conn)
+        if conn.user_id is not None:
+            self.users.setdefault(conn.user_id, set()).add(conn)
+
+    def remove(self, conn: Connection) -> List[str]:
+        # Drops the connection everywhere; returns the channels that now
+        # have no local sockets.
+        self.connections.discard(conn)
+        conns = self.users.get(conn.user_id)
+        if conns is not None:
+            conns.discard(conn)
+            if not conns:
+                del self.users[conn.user_id]
+        emptied = [channel for channel in conn.channels if self.leave(channel, conn)]
+        conn.channels = ()
+        return emptied
+
+    def join(self, channel: str, conn: Connection) -> bool:
+        # True when this is the channel's first local socket.
+        conns = self.channels.get(channel)
+        first = conns is None
+        if first:
+            conns = self.channels[channel] = set()
+        if conn not in conns:
+            conns.add(conn)
+            conn.channels += (channel,)
+        return first
+
+    def leave(self, channel: str, conn: Connection) -> bool:
+        # True when the channel has no local sockets left.
+        conns = self.channels.get(channel)
+        if conns is None or conn not in conns:
+            return False
+        conns.discard(conn)
+        conn.channels = tuple(c for c in conn.channels if c != channel)
+        if conns:
+            return False
+        del self.channels[channel]
+        return True
+
+    def members(self, channel: str) -> Set[Connection]:
+        return self.channels.get(channel, _EMPTY)
+
+    def of_user(self, user_id: int) -> Set[Connection]:
+        return self.users.get(user_id, _EMPTY)
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("websocket heartbeat failed")
+
+    def sweep(self) -> int:
+        now = time.monotonic()
+        ping = EncodedEvent(event("ping"))
+        dead = []
+        for conn in self.connections:
+            if conn.finished:
+                continue
+            if conn.closed:
+                dead.append(conn)
+                continue
+            if conn.protocol is LEGACY:
+                continue
+            idle = now - conn.last_seen
+            if idle >= self.idle_timeout:
+                dead.append(conn)
+            elif idle >= self.interval:
+                conn.send(ping.for_protocol(conn.protocol))
+                self.pings += 1
+        for conn in dead:
+            conn.reap()
+        self.sweeps += 1
+        if dead:
+            logger.info("reaped %d dead websocket connections", len(dead))
+        return len(dead)
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self.connections),
+            "users": len(self.users),
+            "channels": len(self.channels),
+            "heartbeat_sweeps": self.sweeps,
+            "heartbeat_pings": self.pings,
+        }
+
+
+_EMPTY: Set[Connection] = frozenset()
+
+registry = ConnectionRegistry(settings.WS_HEARTBEAT_INTERVAL_SECONDS, settings.WS_IDLE_TIMEOUT_SECONDS)
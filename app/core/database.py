@@ -1,7 +1,76 @@
-from sqlalchemy import create_engine
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool
 from app.core.config import settings
+from app.core.metrics import Counter, Gauge, Histogram
 
-engine = create_engine(settings.SQLALCHEMY_DATABASE_URL, pool_pre_ping=True)
+db_query_duration = Histogram("db_query_duration_seconds", "Time spent executing SQL statements.", ("statement",))
+db_pool_wait = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection.")
+db_pool_timeouts = Counter("db_pool_checkout_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT.")
+
+class TimedQueuePool(QueuePool):
+    # QueuePool that records how long each checkout waited for a connection.
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            db_pool_timeouts.inc()
+            raise
+        finally:
+            db_pool_wait.observe(time.perf_counter() - started)
+
+# Liveness comes from pool_recycle rather than a ping on every checkout:
+# connections older than DB_POOL_RECYCLE are replaced before the server's
+# idle timeout can close them, which saves a round-trip per request.
+_url = make_url(settings.SQLALCHEMY_DATABASE_URL)
+_engine_options = {"pool_pre_ping": settings.DB_POOL_PRE_PING, "pool_recycle": settings.DB_POOL_RECYCLE}
+if _url.get_backend_name() != "sqlite" or _url.database not in (None, "", ":memory:"):
+    _engine_options.update(
+        poolclass=TimedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+    )
+
+engine = create_engine(settings.SQLALCHEMY_DATABASE_URL, **_engine_options)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base() 
\ No newline at end of file
+Base = declarative_base()
+
+def get_db():
+    # Request-scoped session; closed (and any open transaction rolled back)
+    # once the response is done, whether or not the handler raised.
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+_STATEMENTS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    verb = statement.lstrip()[:6].upper()
+    db_query_duration.observe(
+        time.perf_counter() - context._query_started, verb if verb in _STATEMENTS else "OTHER"
+    )
+
+def _pool_stat(method: str):
+    return lambda: {(): getattr(engine.pool, method)()} if isinstance(engine.pool, QueuePool) else {}
+
+Gauge("db_pool_checked_out", "Connections currently checked out of the pool.", callback=_pool_stat("checkedout"))
+Gauge("db_pool_checked_in", "Idle connections held by the pool.", callback=_pool_stat("checkedin"))
+Gauge("db_pool_overflow", "Connections open beyond pool_size (negative while the pool is still filling).", callback=_pool_stat("overflow"))
+Gauge("db_pool_size", "Configured pool_size.", callback=_pool_stat("size"))
+Gauge(
+    "db_pool_saturation", "Checked-out connections as a fraction of pool_size + max_overflow.",
+    callback=lambda: {(): engine.pool.checkedout() / (engine.pool.size() + settings.DB_MAX_OVERFLOW)}
+    if isinstance(engine.pool, QueuePool) else {},
+)
@@ -0,0 +1,164 @@
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.connections import Connection
+from app.core.database import SessionLocal
+from app.core.message_queue import BatchWriter
+from app.core.protocol import event as make_event
+from app.models.delivery import DeliveryCursor, DeliveryEntry
+
+# Trim a user's log once per this many appends rather than on every one.
+TRIM_EVERY = 64
+
+
+def _lock_cursors(db: Session, users: List[int]) -> Dict[int, int]:
+    # Row locks in user id order, so concurrent batches can't deadlock.
+    def locked(ids):
+        return dict(db.query(DeliveryCursor.user_id, DeliveryCursor.last_seq).filter(
+            DeliveryCursor.user_id.in_(ids)
+        ).order_by(DeliveryCursor.user_id).with_for_update().all())
+
+    last = locked(users)
+    missing = [user_id for user_id in users if user_id not in last]
+    if missing:
+        try:
+            with db.begin_nested():
+                db.execute(insert(DeliveryCursor), [{"user_id": user_id, "last_seq": 0} for user_id in missing])
+        except IntegrityError:
+            pass  # another worker created them first
+        last.update(locked(missing))
+    return last
+
+
+def append_entries(batch: List[Tuple[int, dict]], max_per_user: int):
+    # Assigns each event the next sequence number in its user's log (stored
+    # on the event as "seq") and persists the batch in one transaction.
+    db = SessionLocal()
+    try:
+        last = _lock_cursors(db, sorted({user_id for user_id, _ in batch}))
+        previous = dict(last)
+        # Stamped here rather than by the server's now(), which is local
+        # time on MySQL, so prune_expired compares like with like.
+        now = datetime.now(timezone.utc)
+        rows = []
+        for user_id, event in batch:
+            last[user_id] += 1
+            event["seq"] = last[user_id]
+            rows.append({"user_id": user_id, "seq": last[user_id], "event": json.dumps(event), "created_at": now})
+        db.execute(insert(DeliveryEntry), rows)
+        db.execute(update(DeliveryCursor), [{"user_id": user_id, "last_seq": seq} for user_id, seq in last.items()])
+        for user_id, seq in last.items():
+            if seq > max_per_user and seq // TRIM_EVERY != previous[user_id] // TRIM_EVERY:
+                db.query(DeliveryEntry).filter(
+                    DeliveryEntry.user_id == user_id, DeliveryEntry.seq <= seq - max_per_user
+                ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def prune_expired(ttl_seconds: float) -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=ttl_seconds)
+    db = SessionLocal()
+    try:
+        deleted = db.query(DeliveryEntry).filter(DeliveryEntry.created_at < cutoff).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+    finally:
+        db.close()
+
+
+def latest_seq(user_id: int) -> int:
+    db = SessionLocal()
+    try:
+        return db.query(DeliveryCursor.last_seq).filter(DeliveryCursor.user_id == user_id).scalar() or 0
+    finally:
+        db.close()
+
+
+def read_entries(user_id: int, after_seq: int, limit: int) -> List[dict]:
+    db = SessionLocal()
+    try:
+        rows = db.query(DeliveryEntry.event).filter(
+            DeliveryEntry.user_id == user_id, DeliveryEntry.seq > after_seq
+        ).order_by(DeliveryEntry.seq).limit(limit).all()
+    finally:
+        db.close()
+    return [json.loads(row.event) for row in rows]
+
+
+class DeliveryLog(BatchWriter):
+    # Per-user log of everything published to a user's channel. Events are
+    # appended in batches, numbered per user, and only then handed to the
+    # handler for live delivery, so a live event always carries the seq a
+    # client resumes from. Entries expire after DELIVERY_LOG_TTL_SECONDS and
+    # each user keeps at most DELIVERY_LOG_MAX_PER_USER.
+
+    def __init__(self, maxsize: int, max_batch: int, flush_interval: float):
+        super().__init__("deliveries", maxsize, max_batch, flush_interval)
+        self.handler: Optional[Callable[[int, dict], Awaitable[None]]] = None
+        self.last_prune = time.monotonic()
+
+    def set_handler(self, handler: Callable[[int, dict], Awaitable[None]]):
+        self.handler = handler
+
+    async def deliver(self, user_id: int, event: dict):
+        await self.put((user_id, event))
+
+    async def write_batch(self, batch: List[Tuple[int, dict]]):
+        try:
+            await run_in_threadpool(append_entries, batch, settings.DELIVERY_LOG_MAX_PER_USER)
+        finally:
+            # Deliver live even if logging failed; those events just can't
+            # be replayed.
+            for user_id, event in batch:
+                await self.handler(user_id, event)
+        if time.monotonic() - self.last_prune >= settings.DELIVERY_PRUNE_INTERVAL_SECONDS:
+            self.last_prune = time.monotonic()
+            await run_in_threadpool(prune_expired, settings.DELIVERY_LOG_TTL_SECONDS)
+
+
+async def replay(conn: Connection, user_id: int, since: int):
+    # Streams the entries after `since` to a reconnecting client, a page at
+    # a time, between sync_start and sync_done markers. send_wait() gives the
+    # replay backpressure, and the connection's writer coalesces the queued
+    # events into batch frames. truncated
+    # means part of the gap has already expired and the client should reload
+    # history over REST. Live events are held until sync_done, so they don't
+    # count against the slow-consumer limit while the replay fills the
+    # queue; some may repeat replayed ones, and clients drop any seq they
+    # have already applied.
+    protocol = conn.protocol
+    conn.hold()
+    try:
+        latest = await run_in_threadpool(latest_seq, user_id)
+        events = []
+        if since < latest:
+            events = await run_in_threadpool(read_entries, user_id, since, settings.DELIVERY_SYNC_BATCH)
+        truncated = since > latest or (since < latest and (not events or events[0]["seq"] > since + 1))
+        await conn.send_wait(protocol.encode(make_event("sync_start", since=since, latest=latest, truncated=truncated)))
+        while events:
+            for event in events:
+                await conn.send_wait(protocol.encode(event))
+            last = events[-1]["seq"]
+            if last >= latest or len(events) < settings.DELIVERY_SYNC_BATCH:
+                break
+            events = await run_in_threadpool(read_entries, user_id, last, settings.DELIVERY_SYNC_BATCH)
+        await conn.send_wait(protocol.encode(make_event("sync_done", seq=latest)))
+    finally:
+        conn.release()
+
+
+delivery_log = DeliveryLog(
+    settings.DELIVERY_QUEUE_MAXSIZE,
+    settings.DELIVERY_BATCH_MAX_ROWS,
+    settings.DELIVERY_FLUSH_INTERVAL_MS / 1000,
+)
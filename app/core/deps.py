@@ -0,0 +1,32 @@
+import math
+from fastapi import Depends, HTTPException, Request
+from fastapi.security import OAuth2PasswordBearer
+from app.core.cache import get_user_display
+from app.core.ratelimit import RateLimiter
+from app.core.security import decode_access_token
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
+
+def get_current_user(token: str = Depends(oauth2_scheme)) -> dict:
+    payload = decode_access_token(token)
+    if not payload or "sub" not in payload:
+        raise HTTPException(status_code=401, detail="Invalid token", headers={"WWW-Authenticate": "Bearer"})
+    user = get_user_display(int(payload["sub"]))
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found", headers={"WWW-Authenticate": "Bearer"})
+    return user
+
+def _enforce(limiter: RateLimiter, key):
+    wait = limiter.check(key)
+    if wait:
+        raise HTTPException(status_code=429, detail="Too many requests", headers={"Retry-After": str(math.ceil(wait))})
+
+def limit_per_user(limiter: RateLimiter):
+    def dependency(current_user: dict = Depends(get_current_user)):
+        _enforce(limiter, current_user["id"])
+    return dependency
+
+def limit_per_ip(limiter: RateLimiter):
+    def dependency(request: Request):
+        _enforce(limiter, request.client.host if request.client else None)
+    return dependency
@@ -0,0 +1,81 @@
+import csv
+import heapq
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import Iterable, Iterator, Sequence
+
+from sqlalchemy.sql import Select
+
+from app.core.database import SessionLocal
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+ROWS_PER_CHUNK = 500
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def stream_rows(stmt: Select, yield_per: int = 1000) -> Iterator[Sequence]:
+    # Server-side cursor, so the driver never buffers the whole result set.
+    db = SessionLocal()
+    try:
+        result = db.execute(stmt.execution_options(stream_results=True, yield_per=yield_per))
+        for row in result:
+            yield row
+    finally:
+        db.close()
+
+
+def encode_ndjson(columns: Sequence[str], rows: Iterable[Sequence]) -> Iterator[bytes]:
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(dict(zip(columns, row)), default=_json_default))
+        if len(chunk) >= ROWS_PER_CHUNK:
+            yield ("\n".join(chunk) + "\n").encode()
+            chunk = []
+    if chunk:
+        yield ("\n".join(chunk) + "\n").encode()
+
+
+def encode_csv(columns: Sequence[str], rows: Iterable[Sequence]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow(value.isoformat() if isinstance(value, datetime) else value for value in row)
+        count += 1
+        if count % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(stmt: Select, fmt: str, gzip: bool = False, archived: Iterable[Sequence] = ()) -> Iterator[bytes]:
+    # `archived` rows (same columns as stmt, id first, in id order) are merged
+    # with the live ones by id: exports follow ingestion order like history,
+    # not `timestamp`, which imports may set to anything.
+    columns = [column.name for column in stmt.selected_columns]
+    encoder = encode_csv if fmt == "csv" else encode_ndjson
+    chunks = encoder(columns, heapq.merge(archived, stream_rows(stmt), key=lambda row: row[0]))
+    return gzip_chunks(chunks) if gzip else chunks
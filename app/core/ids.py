@@ -0,0 +1,83 @@
+import asyncio
+from typing import List
+
+from anyio import from_thread
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+
+from app.core.broker import broker
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.id_block import IdBlock
+from app.models.message import Message
+
+
+class IdAllocator:
+    # Hands out primary keys from blocks reserved in the id_blocks table, so
+    # rows can be built with their final id before they are inserted. Only
+    # one round-trip per block_size ids is needed. Every insert into the
+    # table must take its id from here, or autoincrement will collide with
+    # reserved ranges.
+    #
+    # Allocation is a broker call, so with the unix backend the worker that
+    # hosts the relay hands out ids for all workers and they are allocated
+    # in arrival order. A relay that takes over reserves a fresh block,
+    # which starts above every id handed out before.
+    #
+    # Allocation is not commit order, though: ids are taken when a message
+    # is queued and each worker's writer commits its batch later, so id N+1
+    # can be visible before id N. A history poller using after_id can skip
+    # a row that commits late; live clients should rely on the delivery
+    # log's seq and resync (?since=) instead.
+
+    def __init__(self, name: str, id_column, block_size: int):
+        self.name = name
+        self.id_column = id_column
+        self.block_size = block_size
+        self.lock = asyncio.Lock()
+        self.next_id = 0
+        self.limit = 0
+        broker.register(f"ids:{name}", self._serve)
+
+    async def allocate_async(self, count: int = 1) -> List[int]:
+        return await broker.call(f"ids:{self.name}", count)
+
+    def allocate(self, count: int = 1) -> List[int]:
+        # For threadpool handlers: the call runs on the event loop.
+        return from_thread.run(self.allocate_async, count)
+
+    async def _serve(self, count: int) -> List[int]:
+        ids: List[int] = []
+        async with self.lock:
+            while len(ids) < count:
+                if self.next_id >= self.limit:
+                    await run_in_threadpool(self._reserve, max(self.block_size, count - len(ids)))
+                take = min(self.limit - self.next_id, count - len(ids))
+                ids.extend(range(self.next_id, self.next_id + take))
+                self.next_id += take
+        return ids
+
+    def _reserve(self, size: int):
+        while True:
+            db = SessionLocal()
+            try:
+                block = db.query(IdBlock).filter(IdBlock.name == self.name).with_for_update().first()
+                if block is None:
+                    start = (db.query(func.max(self.id_column)).scalar() or 0) + 1
+                    block = IdBlock(name=self.name, next_id=start)
+                    db.add(block)
+                start = block.next_id
+                block.next_id = start + size
+                db.commit()
+            except IntegrityError:
+                # Another worker created the row first; take a block from it.
+                db.rollback()
+                continue
+            finally:
+                db.close()
+            self.next_id, self.limit = start, start + size
+            return
+
+
+message_ids = IdAllocator("messages", Message.id, settings.MESSAGE_ID_BLOCK_SIZE)
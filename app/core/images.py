@@ -0,0 +1,87 @@
+import asyncio
+import hashlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+from PIL import Image, ImageOps
+
+from app.core.config import settings
+
+AVATAR_DIR = os.path.join("uploads", "avatars")
+AVATAR_SIZES = (64, 128, 256)
+AVATAR_FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+MAX_PIXELS = 50_000_000
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def avatar_variant_names():
+    return [f"{size}.{ext}" for size in AVATAR_SIZES for ext in AVATAR_FORMATS]
+
+
+def avatar_path(digest: str, variant: str) -> str:
+    return os.path.join(AVATAR_DIR, digest[:2], digest, variant)
+
+
+def store_avatar(data: bytes) -> str:
+    # Runs in a worker process. Decodes the upload once (at reduced scale
+    # for JPEG via draft mode) and writes every size/format variant into a
+    # directory named after the content hash, so an identical upload is free
+    # and a stored variant never changes.
+    digest = hashlib.sha256(data).hexdigest()
+    directory = os.path.join(AVATAR_DIR, digest[:2], digest)
+    if all(os.path.exists(os.path.join(directory, name)) for name in avatar_variant_names()):
+        return digest
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            largest = max(AVATAR_SIZES)
+            image.draft("RGB", (largest * 2, largest * 2))
+            image = ImageOps.exif_transpose(image).convert("RGB")
+    except (OSError, Image.DecompressionBombError) as exc:
+        raise InvalidImage(str(exc)) from exc
+    os.makedirs(directory, exist_ok=True)
+    for size in AVATAR_SIZES:
+        variant = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        for ext, (fmt, _, options) in AVATAR_FORMATS.items():
+            path = os.path.join(directory, f"{size}.{ext}")
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            variant.save(tmp_path, fmt, **options)
+            os.replace(tmp_path, path)
+    return digest
+
+
+class ImageProcessor:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.semaphore = asyncio.Semaphore(workers * 2)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def store_avatar(self, data: bytes) -> str:
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), store_avatar, data)
+
+
+image_processor = ImageProcessor(settings.IMAGE_WORKERS or os.cpu_count() or 1)
+
+
+def avatar_urls(digest: str) -> Dict[str, str]:
+    return {name: f"/api/avatars/{digest}/{name}" for name in avatar_variant_names()}
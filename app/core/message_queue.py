@@ -0,0 +1,254 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from sqlalchemy import insert
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.ids import message_ids
+from app.core.metrics import Counter, Gauge, Histogram
+from app.core.search import search_index
+from app.core.serialize import dumps
+from app.core.ticket_stats import mark_responded, record_first_responses
+from app.core.unread import record_unread
+from app.models.message import Message
+
+logger = logging.getLogger(__name__)
+
+_writers = []
+
+flush_duration = Histogram("write_queue_flush_seconds", "Time to persist one batch.", ("queue",))
+flush_rows = Histogram("write_queue_batch_rows", "Rows per flushed batch.", ("queue",), buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000))
+enqueue_wait = Histogram("write_queue_enqueue_wait_seconds", "Time a producer waited on a full queue.", ("queue",))
+rows_failed = Counter("write_queue_failed_total", "Rows that could not be persisted.", ("queue",))
+rows_dead_lettered = Counter("write_queue_dead_lettered_total", "Rows saved to the dead-letter file after retries.", ("queue",))
+
+
+def insert_messages(rows: List[dict]):
+    db = SessionLocal()
+    try:
+        db.execute(insert(Message), rows)
+        record_unread(db, rows)
+        responded = record_first_responses(db, rows)
+        db.commit()
+    finally:
+        db.close()
+    mark_responded(responded)
+    try:
+        search_index.index_messages(rows)
+    except Exception:
+        logger.exception("failed to index %d messages for search", len(rows))
+
+
+class BatchWriter:
+    # Write-behind queue. Producers put rows and return immediately; a
+    # background task groups up to max_batch rows, waiting at most
+    # flush_interval for a batch to fill, and hands them to write_batch().
+    # When the queue is full, put() waits, which slows the producer down
+    # instead of growing memory without bound.
+    #
+    # Durable writers don't drop a batch that fails: it is retried with
+    # backoff, then row by row so one bad row can't sink the rest, and rows
+    # that still fail are appended to DEAD_LETTER_DIR/<name>.jsonl.
+
+    durable = False
+
+    def __init__(self, name: str, maxsize: int, max_batch: int, flush_interval: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.written = 0
+        self.failed = 0
+        self.dead_lettered = 0
+        self.batches = 0
+        self.blocked = 0
+        self.blocked_seconds = 0.0
+        self.max_depth = 0
+        _writers.append(self)
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        await self.queue.join()
+        self.task.cancel()
+        self.task = None
+
+    async def put(self, row):
+        if self.task is None:
+            await self._write([row])
+            return
+        if self.queue.full():
+            self.blocked += 1
+            started = time.perf_counter()
+            await self.queue.put(row)
+            waited = time.perf_counter() - started
+            self.blocked_seconds += waited
+            enqueue_wait.observe(waited, self.name)
+        else:
+            self.queue.put_nowait(row)
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.max_batch:
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            remaining = deadline - loop.time()
+            if len(batch) >= self.max_batch or remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            await self._write(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    async def write_batch(self, batch: list):
+        raise NotImplementedError
+
+    async def _write(self, batch: list):
+        started = time.perf_counter()
+        try:
+            await self.write_batch(batch)
+        except Exception:
+            logger.exception("failed to persist %d %s", len(batch), self.name)
+            lost = await self._recover(batch) if self.durable else batch
+            self.written += len(batch) - len(lost)
+            self.failed += len(lost)
+            rows_failed.inc(len(lost), self.name)
+            return
+        flush_duration.observe(time.perf_counter() - started, self.name)
+        flush_rows.observe(len(batch), self.name)
+        self.written += len(batch)
+        self.batches += 1
+
+    async def _recover(self, batch: list) -> list:
+        # Returns the rows that could not be written.
+        delay = 0.1
+        for attempt in range(1, settings.WRITE_RETRY_ATTEMPTS + 1):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5.0)
+            try:
+                await self.write_batch(batch)
+                logger.info("persisted %d %s on retry %d", len(batch), self.name, attempt)
+                return []
+            except Exception as exc:
+                logger.warning("retry %d for %d %s failed: %r", attempt, len(batch), self.name, exc)
+        lost = []
+        for row in batch:
+            try:
+                await self.write_batch([row])
+            except Exception:
+                lost.append(row)
+        if lost:
+            try:
+                await run_in_threadpool(self._dead_letter, lost)
+            except Exception:
+                logger.exception("could not dead-letter %d %s: %r", len(lost), self.name, lost)
+        return lost
+
+    def _dead_letter(self, rows: list):
+        os.makedirs(settings.DEAD_LETTER_DIR, exist_ok=True)
+        with open(os.path.join(settings.DEAD_LETTER_DIR, f"{self.name}.jsonl"), "ab") as f:
+            for row in rows:
+                f.write(dumps(row) + b"\n")
+        self.dead_lettered += len(rows)
+        rows_dead_lettered.inc(len(rows), self.name)
+        logger.error("dead-lettered %d %s to %s", len(rows), self.name, settings.DEAD_LETTER_DIR)
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.queue.qsize() if self.queue else 0,
+            "max_depth": self.max_depth,
+            "capacity": self.maxsize,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "failed": self.failed,
+            "dead_lettered": self.dead_lettered,
+            "batches": self.batches,
+            "blocked_puts": self.blocked,
+            "blocked_seconds": round(self.blocked_seconds, 6),
+        }
+
+
+class MessageWriter(BatchWriter):
+    # Chat messages are written with one multi-row INSERT per batch on the
+    # threadpool. Ids and timestamps are assigned at enqueue time, so nothing
+    # has to be read back after the insert. Clients have already seen a
+    # message by the time it is written, so the writer is durable.
+
+    durable = True
+
+    async def enqueue(self, row: dict) -> dict:
+        row["id"] = (await message_ids.allocate_async())[0]
+        row.setdefault("timestamp", datetime.now(timezone.utc))
+        await self.put(row)
+        return row
+
+    async def write_batch(self, batch: List[dict]):
+        await run_in_threadpool(insert_messages, batch)
+
+
+message_writer = MessageWriter(
+    "messages",
+    settings.MESSAGE_QUEUE_MAXSIZE,
+    settings.MESSAGE_BATCH_MAX_ROWS,
+    settings.MESSAGE_FLUSH_INTERVAL_MS / 1000,
+)
+
+Gauge("write_queue_depth", "Rows waiting to be written.", ("queue",),
+      callback=lambda: {(w.name,): w.queue.qsize() if w.queue else 0 for w in _writers})
+Counter("write_queue_written_total", "Rows persisted by write-behind queues.", ("queue",),
+        callback=lambda: {(w.name,): w.written for w in _writers})
+
+
+def replay_dead_letters(path: str) -> int:
+    # Inserts the dead-lettered messages in `path` that aren't in the table
+    # yet, then renames the file to <path>.done.
+    with open(path) as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    for row in rows:
+        row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+    db = SessionLocal()
+    try:
+        existing = set()
+        for start in range(0, len(rows), settings.MESSAGE_BATCH_MAX_ROWS):
+            ids = [row["id"] for row in rows[start:start + settings.MESSAGE_BATCH_MAX_ROWS]]
+            existing.update(message_id for (message_id,) in db.query(Message.id).filter(Message.id.in_(ids)))
+    finally:
+        db.close()
+    missing = [row for row in rows if row["id"] not in existing]
+    for start in range(0, len(missing), settings.MESSAGE_BATCH_MAX_ROWS):
+        insert_messages(missing[start:start + settings.MESSAGE_BATCH_MAX_ROWS])
+    os.rename(path, path + ".done")
+    return len(missing)
+
+
+if __name__ == "__main__":
+    # python -m app.core.message_queue [data/dead_letter/messages.jsonl]
+    target = sys.argv[1] if len(sys.argv) > 1 else os.path.join(settings.DEAD_LETTER_DIR, f"{message_writer.name}.jsonl")
+    print("replayed", replay_dead_letters(target))
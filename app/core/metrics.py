@@ -0,0 +1,191 @@
+import bisect
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Small in-process metrics registry rendered in the Prometheus text format.
+# Updates are a dict lookup, a lock and an add, so instrumentation stays on
+# under load. Each worker process keeps its own registry; with several
+# uvicorn workers a scrape sees whichever worker answered, so scrape per
+# worker (or run one worker per port) when exact totals matter.
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.values: Dict[LabelValues, float] = {}
+        registry.register(self)
+
+    def samples(self) -> Iterable[Tuple[str, LabelValues, str, float]]:
+        # (name suffix, label values, extra label, value)
+        if self.callback:
+            values = self.callback()
+        else:
+            with self.lock:
+                values = dict(self.values)
+        for labelvalues, value in values.items():
+            yield "", labelvalues, "", value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labelvalues, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_labels(self.labelnames, labelvalues, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, *labelvalues: str):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labelvalues: str):
+        with self.lock:
+            self.values[labelvalues] = value
+
+    def inc(self, amount: float = 1, *labelvalues: str):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (last is +Inf), sum]
+        self.series: Dict[LabelValues, list] = {}
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value: float, *labelvalues: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labelvalues)
+            if series is None:
+                series = self.series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, *labelvalues: str) -> "_Timer":
+        return _Timer(self, labelvalues)
+
+    def samples(self):
+        with self.lock:
+            snapshot = {labels: (list(counts), total) for labels, (counts, total) in self.series.items()}
+        for labelvalues, (counts, total) in snapshot.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield "_bucket", labelvalues, f'le="{_format_value(bound)}"', cumulative
+            yield "_sum", labelvalues, "", total
+            yield "_count", labelvalues, "", cumulative
+
+
+class _Timer:
+    __slots__ = ("histogram", "labelvalues", "started")
+
+    def __init__(self, histogram: Histogram, labelvalues: LabelValues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labelvalues)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+http_requests = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+http_duration = Histogram("http_request_duration_seconds", "HTTP request latency, including the response body.", ("method", "route"))
+http_in_flight = Gauge("http_requests_in_flight", "HTTP requests currently being served.")
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware (not BaseHTTPMiddleware) so streaming responses
+    # pass straight through and are timed until the last body chunk. Routes
+    # are labelled by their path template to keep cardinality bounded.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_in_flight.inc(1)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_in_flight.inc(-1)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            http_duration.observe(time.perf_counter() - started, method, path)
+            http_requests.inc(1, method, path, str(status))
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from sqlalchemy import or_
+
+from app.core.broker import broker
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.protocol import event
+from app.models.user import UserContact
+
+logger = logging.getLogger(__name__)
+
+# Broker state used here (shared by all workers):
+#   presence:        user_id  -> number of open chat sockets
+#   presence_status: user_id  -> "away" while the user has said so
+#   ticket_users:    ticket_id -> set of user ids in the ticket room
+#   typing:          conversation -> set of user ids currently typing
+ONLINE, AWAY, OFFLINE = "online", "away", "offline"
+
+_contacts = TTLCache("contacts", settings.CACHE_MAXSIZE, settings.CACHE_TTL_SECONDS)
+
+Publisher = Callable[[int, dict], Awaitable[None]]
+
+
+def _load_contacts(user_id: int) -> List[int]:
+    db = SessionLocal()
+    try:
+        rows = db.query(UserContact.user1_id, UserContact.user2_id).filter(
+            or_(UserContact.user1_id == user_id, UserContact.user2_id == user_id)
+        ).all()
+    finally:
+        db.close()
+    return sorted({a if b == user_id else b for a, b in rows} - {user_id})
+
+
+def dm_typing_key(a: int, b: int) -> str:
+    low, high = sorted((a, b))
+    return f"dm:{low}:{high}"
+
+
+def ticket_typing_key(ticket_id: int) -> str:
+    return f"ticket:{ticket_id}"
+
+
+def status_of(user_id: int) -> str:
+    if broker.get("presence", user_id, 0) <= 0:
+        return OFFLINE
+    return broker.get("presence_status", user_id) or ONLINE
+
+
+def member_status(user_id: int) -> str:
+    # A room member has a ticket socket open, so is online even without a
+    # chat socket (which is all the presence counter tracks).
+    status = status_of(user_id)
+    return ONLINE if status == OFFLINE else status
+
+
+class PresenceService:
+    # Presence and typing changes are only recorded as dirty here; a
+    # background task flushes them every PRESENCE_FLUSH_MS. A status that
+    # flips several times in one interval goes out once, as its final value,
+    # and only to contacts who are online plus the ticket rooms the user is
+    # in. Typing goes out as one frame per conversation per interval listing
+    # everyone typing, so a busy ticket room costs O(members) frames per
+    # interval rather than a frame per keystroke per member.
+
+    def __init__(self, interval: float, typing_ttl: float):
+        self.interval = interval
+        self.typing_ttl = typing_ttl
+        self.to_user: Optional[Publisher] = None
+        self.to_ticket: Optional[Publisher] = None
+        self.task: Optional[asyncio.Task] = None
+        self.dirty_users: Set[int] = set()
+        self.dirty_rooms: Set[int] = set()
+        self.dirty_typing: Set[str] = set()
+        # Typers connected to this worker: conversation -> user_id -> expiry
+        self.local_typing: Dict[str, Dict[int, float]] = {}
+        self.rooms_of: Dict[int, Set[int]] = {}
+        self.last_status: Dict[int, str] = {}
+        self.flushes = 0
+        self.events_sent = 0
+
+    def set_publishers(self, to_user: Publisher, to_ticket: Publisher):
+        self.to_user = to_user
+        self.to_ticket = to_ticket
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    # --- inputs -------------------------------------------------------
+
+    def user_changed(self, user_id: int):
+        self.dirty_users.add(user_id)
+
+    def set_away(self, user_id: int, away: bool):
+        # Status frames aren't rate limited, so repeats must cost nothing.
+        if away == (broker.get("presence_status", user_id) == AWAY):
+            return
+        if away:
+            broker.set("presence_status", user_id, AWAY)
+        else:
+            broker.delete("presence_status", user_id)
+        self.dirty_users.add(user_id)
+
+    def room_joined(self, ticket_id: int, user_id: int):
+        self.rooms_of.setdefault(user_id, set()).add(ticket_id)
+        self.dirty_rooms.add(ticket_id)
+
+    def room_left(self, ticket_id: int, user_id: int):
+        rooms = self.rooms_of.get(user_id)
+        if rooms is not None:
+            rooms.discard(ticket_id)
+            if not rooms:
+                del self.rooms_of[user_id]
+        self.set_typing(ticket_typing_key(ticket_id), user_id, False)
+        self.dirty_rooms.add(ticket_id)
+
+    def set_typing(self, conversation: str, user_id: int, active: bool):
+        typers = self.local_typing.setdefault(conversation, {})
+        if active:
+            if user_id not in typers:
+                broker.sadd("typing", conversation, user_id)
+                self.dirty_typing.add(conversation)
+            # Repeated "typing" frames only push the expiry out.
+            typers[user_id] = time.monotonic() + self.typing_ttl
+        elif typers.pop(user_id, None) is not None:
+            broker.srem("typing", conversation, user_id)
+            self.dirty_typing.add(conversation)
+        if not typers:
+            del self.local_typing[conversation]
+
+    # --- flushing -----------------------------------------------------
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("presence flush failed")
+
+    def _expire_typing(self):
+        now = time.monotonic()
+        for conversation, typers in list(self.local_typing.items()):
+            for user_id, expires in list(typers.items()):
+                if expires <= now:
+                    self.set_typing(conversation, user_id, False)
+
+    async def flush(self):
+        self._expire_typing()
+        users, rooms, typing = self.dirty_users, self.dirty_rooms, self.dirty_typing
+        self.dirty_users, self.dirty_rooms, self.dirty_typing = set(), set(), set()
+        self.flushes += 1
+
+        per_recipient: Dict[int, List[dict]] = {}
+        for user_id in users:
+            status = status_of(user_id)
+            if self.last_status.get(user_id) == status:
+                continue
+            rooms.update(self.rooms_of.get(user_id, ()))
+            try:
+                contacts = await _contacts.aget_or_load(user_id, _load_contacts)
+            except Exception:
+                # Retried next interval; rooms and typing still go out now.
+                logger.exception("failed to load contacts of user %s", user_id)
+                self.dirty_users.add(user_id)
+                continue
+            if status == OFFLINE:
+                self.last_status.pop(user_id, None)
+            else:
+                self.last_status[user_id] = status
+            for contact_id in contacts:
+                if broker.get("presence", contact_id, 0) > 0:
+                    per_recipient.setdefault(contact_id, []).append({"user_id": user_id, "status": status})
+        for recipient, changes in per_recipient.items():
+            await self._send(self.to_user, recipient, event("presence", users=changes))
+
+        for ticket_id in rooms:
+            members = sorted(broker.smembers("ticket_users", ticket_id))
+            await self._send(self.to_ticket, ticket_id, event(
+                "room", ticket_id=ticket_id,
+                members=[{"user_id": member, "status": member_status(member)} for member in members],
+            ))
+
+        for conversation in typing:
+            typers = sorted(broker.smembers("typing", conversation))
+            kind, *ids = conversation.split(":")
+            if kind == "ticket":
+                ticket_id = int(ids[0])
+                await self._send(self.to_ticket, ticket_id, event("typing", ticket_id=ticket_id, user_ids=typers))
+            else:
+                a, b = int(ids[0]), int(ids[1])
+                await self._send(self.to_user, a, event("typing", peer_id=b, typing=b in typers))
+                await self._send(self.to_user, b, event("typing", peer_id=a, typing=a in typers))
+
+    async def _send(self, publisher: Publisher, target: int, payload: dict):
+        self.events_sent += 1
+        await publisher(target, payload)
+
+    def stats(self) -> dict:
+        return {
+            "flushes": self.flushes,
+            "events_sent": self.events_sent,
+            "local_typing_conversations": len(self.local_typing),
+            "pending_users": len(self.dirty_users),
+            "pending_rooms": len(self.dirty_rooms),
+            "pending_typing": len(self.dirty_typing),
+        }
+
+
+presence = PresenceService(settings.PRESENCE_FLUSH_MS / 1000, settings.TYPING_TTL_SECONDS)
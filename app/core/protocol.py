@@ -0,0 +1,169 @@
+import json
+import struct
+from datetime import datetime
+from typing import Dict, List, Optional, Union
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+try:
+    import msgpack
+except ImportError:  # optional: only the JSON subprotocol is offered without it
+    msgpack = None
+
+# WebSocket wire protocol. Clients pick an encoding through the
+# Sec-WebSocket-Protocol header:
+#
+#   supportchat.v1.json     text frames, one JSON event or a JSON array of events
+#   supportchat.v1.msgpack  binary frames, one MessagePack map or an array of maps
+#
+# Clients that ask for neither get the original plain-text frames. Events are
+# plain dicts with a "type" key; handlers publish them once and each worker
+# encodes a broadcast once per protocol in use, not once per recipient.
+# Structured protocols may receive several events in one frame when a client
+# falls behind (see Connection). permessage-deflate is negotiated by uvicorn
+# (--ws-per-message-deflate, on by default) and applies to every protocol.
+
+Frame = Union[str, bytes]
+VERSION = 1
+
+
+class Protocol:
+    name: Optional[str] = None
+    batching = False
+
+    def encode(self, event: dict) -> Optional[Frame]:
+        # None means the event isn't sent to clients of this protocol.
+        raise NotImplementedError
+
+    def decode(self, frame: Frame) -> Optional[dict]:
+        raise NotImplementedError
+
+    def batch(self, frames: List[Frame]) -> Frame:
+        raise NotImplementedError
+
+
+class LegacyTextProtocol(Protocol):
+    # The original ad-hoc strings, kept for clients that don't negotiate.
+
+    def encode(self, event):
+        kind = event["type"]
+        if kind == "chat":
+            return f"{event['sender_id']}: {event['content']}"
+        if kind == "ticket_message":
+            timestamp = datetime.fromisoformat(event["ts"]).strftime('%I:%M %p')
+            return f"{event['sender_id']}:{event['content']}|{timestamp}|{event.get('sender_name') or ''}"
+        if kind == "notify":
+            return f"NOTIFY:ticket:{event['ticket_id']}:{event['title']}:{event['preview']}"
+        if kind == "signal":
+            data = event["data"]
+            return data if isinstance(data, str) else json.dumps(data)
+        # Presence, typing and the like have no legacy form.
+        return None
+
+    def decode(self, frame):
+        if isinstance(frame, bytes):
+            frame = frame.decode(errors="replace")
+        # JSON frames were control messages for the browser client and are
+        # not chat content.
+        try:
+            json.loads(frame)
+        except ValueError:
+            return {"type": "message", "content": frame}
+        return {"type": "control", "raw": frame}
+
+
+class JSONProtocol(Protocol):
+    name = "supportchat.v1.json"
+    batching = True
+
+    def encode(self, event):
+        return json.dumps(event, separators=(",", ":"), ensure_ascii=False)
+
+    def decode(self, frame):
+        try:
+            event = json.loads(frame)
+        except ValueError:
+            return None
+        return event if isinstance(event, dict) else None
+
+    def batch(self, frames):
+        # Frames are already-encoded objects, so joining them is enough.
+        return "[" + ",".join(frames) + "]"
+
+
+class MsgPackProtocol(Protocol):
+    name = "supportchat.v1.msgpack"
+    batching = True
+
+    def encode(self, event):
+        return msgpack.packb(event, use_bin_type=True)
+
+    def decode(self, frame):
+        if isinstance(frame, str):
+            return None
+        try:
+            event = msgpack.unpackb(frame, raw=False)
+        except (ValueError, msgpack.UnpackException):
+            return None
+        return event if isinstance(event, dict) else None
+
+    def batch(self, frames):
+        count = len(frames)
+        if count < 16:
+            header = bytes((0x90 | count,))
+        elif count < 0x10000:
+            header = b"\xdc" + struct.pack(">H", count)
+        else:
+            header = b"\xdd" + struct.pack(">I", count)
+        return header + b"".join(frames)
+
+
+LEGACY = LegacyTextProtocol()
+PROTOCOLS: Dict[str, Protocol] = {JSONProtocol.name: JSONProtocol()}
+if msgpack is not None:
+    PROTOCOLS[MsgPackProtocol.name] = MsgPackProtocol()
+
+
+def negotiate(websocket: WebSocket) -> Protocol:
+    # First subprotocol in the client's preference order that we speak.
+    for requested in websocket.scope.get("subprotocols", ()):
+        if requested in PROTOCOLS:
+            return PROTOCOLS[requested]
+    return LEGACY
+
+
+async def accept(websocket: WebSocket) -> Protocol:
+    protocol = negotiate(websocket)
+    await websocket.accept(subprotocol=protocol.name)
+    return protocol
+
+
+async def receive(websocket: WebSocket, protocol: Protocol) -> Optional[dict]:
+    # Next decoded event from the client, or None for a frame that doesn't
+    # parse. Raises WebSocketDisconnect like receive_text().
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message["code"], message.get("reason"))
+    frame = message.get("text")
+    if frame is None:
+        frame = message.get("bytes")
+    return protocol.decode(frame)
+
+
+class EncodedEvent:
+    # One event being fanned out to local sockets; each protocol encodes it
+    # at most once.
+    __slots__ = ("event", "frames")
+
+    def __init__(self, event: dict):
+        self.event = event
+        self.frames: Dict[Protocol, Optional[Frame]] = {}
+
+    def for_protocol(self, protocol: Protocol) -> Optional[Frame]:
+        if protocol not in self.frames:
+            self.frames[protocol] = protocol.encode(self.event)
+        return self.frames[protocol]
+
+
+def event(kind: str, **fields) -> dict:
+    return dict(fields, type=kind, v=VERSION)
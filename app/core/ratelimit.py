@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import time
+from typing import Dict, Hashable
+
+from app.core.config import settings
+from app.core.metrics import Counter
+
+rate_limited = Counter("rate_limited_total", "Requests and frames refused by a rate limit.", ("limit",))
+
+_limiters = []
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    # Token buckets keyed by user, ticket or IP: each key may spend `burst`
+    # at once and earns `rate` tokens per second back. A rate of 0 turns the
+    # limit off. Buckets live in this worker only, so with N workers a
+    # client spread across them gets up to N times the rate; a client's
+    # sockets and keep-alive connections usually stay on one worker anyway.
+    # Safe to share between the event loop and threadpool handlers.
+
+    def __init__(self, name: str, rate: float, burst: float, maxsize: int = 100000):
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.buckets: Dict[Hashable, TokenBucket] = {}
+        self.allowed = 0
+        self.limited = 0
+        _limiters.append(self)
+
+    def check(self, key: Hashable, cost: float = 1) -> float:
+        # Spends `cost` tokens and returns 0, or returns how many seconds
+        # until the key could afford it (spending nothing).
+        if not self.rate:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.maxsize:
+                    self._prune(now)
+                bucket = self.buckets[key] = TokenBucket(self.burst, now)
+            else:
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+                bucket.updated = now
+            if bucket.tokens >= cost:
+                bucket.tokens -= cost
+                self.allowed += 1
+                return 0
+            self.limited += 1
+            wait = (cost - bucket.tokens) / self.rate
+        rate_limited.inc(1, self.name)
+        return wait
+
+    def refund(self, key: Hashable, cost: float = 1):
+        # Gives back tokens spent by check() on something a later limit
+        # refused, so only what actually goes through is charged.
+        if not self.rate:
+            return
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.tokens = min(self.burst, bucket.tokens + cost)
+                self.allowed -= 1
+
+    def _prune(self, now: float):
+        # A bucket that has refilled completely is the same as no bucket.
+        full = [key for key, bucket in self.buckets.items()
+                if bucket.tokens + (now - bucket.updated) * self.rate >= self.burst]
+        for key in full:
+            del self.buckets[key]
+        if len(self.buckets) >= self.maxsize:
+            self.buckets.clear()
+
+    def stats(self) -> dict:
+        return {"keys": len(self.buckets), "allowed": self.allowed, "limited": self.limited}
+
+
+class AdmissionGate:
+    # Paces new WebSocket accepts for this worker. Up to `burst` handshakes
+    # go straight through; beyond that they are queued at `rate` per second,
+    # so a reconnect storm after a deploy is spread out instead of arriving
+    # all at once. A handshake that would wait longer than `max_wait` is
+    # refused and the client retries later with its own backoff.
+
+    def __init__(self, rate: float, burst: float, max_wait: float):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_wait = max_wait
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.admitted = 0
+        self.delayed = 0
+        self.rejected = 0
+
+    async def admit(self) -> bool:
+        if not self.rate:
+            self.admitted += 1
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.admitted += 1
+            return True
+        wait = (1 - self.tokens) / self.rate
+        if wait > self.max_wait:
+            self.rejected += 1
+            rate_limited.inc(1, "ws_accept")
+            return False
+        # Reserve the token now so later arrivals queue up behind this one.
+        self.tokens -= 1
+        self.delayed += 1
+        await asyncio.sleep(wait)
+        self.admitted += 1
+        return True
+
+    def stats(self) -> dict:
+        return {"admitted": self.admitted, "delayed": self.delayed, "rejected": self.rejected}
+
+
+Counter("ws_admission_total", "WebSocket handshakes by admission outcome.", ("outcome",), callback=lambda: {
+    ("admitted",): admission.admitted, ("delayed",): admission.delayed, ("rejected",): admission.rejected,
+})
+
+ws_frames = RateLimiter("ws_frames", settings.WS_USER_FRAME_RATE, settings.WS_USER_FRAME_BURST)
+ticket_frames = RateLimiter("ticket_frames", settings.WS_TICKET_MESSAGE_RATE, settings.WS_TICKET_MESSAGE_BURST)
+ws_connects = RateLimiter("ws_connects", settings.WS_IP_CONNECT_RATE, settings.WS_IP_CONNECT_BURST)
+message_sends = RateLimiter("message_sends", settings.MESSAGE_SEND_RATE, settings.MESSAGE_SEND_BURST)
+ticket_creates = RateLimiter("ticket_creates", settings.TICKET_CREATE_RATE, settings.TICKET_CREATE_BURST)
+logins = RateLimiter("logins", settings.LOGIN_RATE, settings.LOGIN_BURST)
+admission = AdmissionGate(settings.WS_ACCEPT_RATE, settings.WS_ACCEPT_BURST, settings.WS_ACCEPT_MAX_WAIT_SECONDS)
+
+
+def rate_limit_stats() -> dict:
+    return dict({limiter.name: limiter.stats() for limiter in _limiters}, ws_accept=admission.stats())
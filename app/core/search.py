@@ -0,0 +1,201 @@
+import logging
+import os
+import sqlite3
+import threading
+from typing import List, Optional
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import SessionLocal, engine
+
+logger = logging.getLogger(__name__)
+
+
+class SearchBackend:
+    def index_messages(self, rows: List[dict]):
+        pass
+
+    def remove_messages(self, ids: List[int]):
+        pass
+
+    def index_ticket(self, ticket_id: int, title: str, description: Optional[str], creator_id: int):
+        pass
+
+    def search_messages(self, query: str, limit: int, offset: int, user_id: Optional[int] = None) -> List[dict]:
+        raise NotImplementedError
+
+    def search_tickets(self, query: str, limit: int, offset: int, user_id: Optional[int] = None) -> List[dict]:
+        raise NotImplementedError
+
+
+class MySQLFullTextSearch(SearchBackend):
+    # InnoDB maintains the FULLTEXT indexes as part of each INSERT, so the
+    # write path has nothing extra to do.
+
+    def search_messages(self, query, limit, offset, user_id=None):
+        scope = "AND (sender_id = :user_id OR receiver_id = :user_id)" if user_id is not None else ""
+        sql = text(f"""
+            SELECT id, ticket_id, sender_id, receiver_id, content,
+                   MATCH(content) AGAINST (:q IN NATURAL LANGUAGE MODE) AS score
+            FROM messages
+            WHERE MATCH(content) AGAINST (:q IN NATURAL LANGUAGE MODE) {scope}
+            ORDER BY score DESC, id DESC
+            LIMIT :limit OFFSET :offset
+        """)
+        db = SessionLocal()
+        try:
+            rows = db.execute(sql, {"q": query, "user_id": user_id, "limit": limit, "offset": offset}).mappings().all()
+        finally:
+            db.close()
+        return [dict(row, snippet=row["content"][:200]) for row in rows]
+
+    def search_tickets(self, query, limit, offset, user_id=None):
+        scope = "AND creator_id = :user_id" if user_id is not None else ""
+        sql = text(f"""
+            SELECT id, title, description, creator_id,
+                   MATCH(title, description) AGAINST (:q IN NATURAL LANGUAGE MODE) AS score
+            FROM tickets
+            WHERE MATCH(title, description) AGAINST (:q IN NATURAL LANGUAGE MODE) {scope}
+            ORDER BY score DESC, id DESC
+            LIMIT :limit OFFSET :offset
+        """)
+        db = SessionLocal()
+        try:
+            rows = db.execute(sql, {"q": query, "user_id": user_id, "limit": limit, "offset": offset}).mappings().all()
+        finally:
+            db.close()
+        return [dict(row, snippet=(row["description"] or "")[:200]) for row in rows]
+
+
+class SQLiteFTSSearch(SearchBackend):
+    # Embedded FTS5 index on local disk for dev/test. It is fed from the
+    # message write path and ticket creation, and can be rebuilt from the
+    # primary database with rebuild(). The file is opened on first use, so
+    # importing this module doesn't create it.
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.opening = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            with self.opening:
+                if self._conn is None:
+                    self._conn = self._open()
+        return self._conn
+
+    def _open(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+            "content, ticket_id UNINDEXED, sender_id UNINDEXED, receiver_id UNINDEXED, tokenize='unicode61')"
+        )
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS tickets_fts USING fts5("
+            "title, description, creator_id UNINDEXED, tokenize='unicode61')"
+        )
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def _match(query: str) -> str:
+        # Quote every term so user input can't hit FTS5 query syntax.
+        return " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+    def index_messages(self, rows):
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO messages_fts (rowid, content, ticket_id, sender_id, receiver_id) VALUES (?, ?, ?, ?, ?)",
+                [(r["id"], r["content"], r.get("ticket_id"), r["sender_id"], r.get("receiver_id")) for r in rows],
+            )
+            self.conn.commit()
+
+    def remove_messages(self, ids):
+        with self.lock:
+            self.conn.executemany("DELETE FROM messages_fts WHERE rowid = ?", [(message_id,) for message_id in ids])
+            self.conn.commit()
+
+    def index_ticket(self, ticket_id, title, description, creator_id):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO tickets_fts (rowid, title, description, creator_id) VALUES (?, ?, ?, ?)",
+                (ticket_id, title, description or "", creator_id),
+            )
+            self.conn.commit()
+
+    def search_messages(self, query, limit, offset, user_id=None):
+        scope = "AND (sender_id = :user_id OR receiver_id = :user_id)" if user_id is not None else ""
+        sql = f"""
+            SELECT rowid, ticket_id, sender_id, receiver_id,
+                   snippet(messages_fts, 0, '[', ']', '...', 16), -bm25(messages_fts) AS score
+            FROM messages_fts
+            WHERE messages_fts MATCH :q {scope}
+            ORDER BY bm25(messages_fts)
+            LIMIT :limit OFFSET :offset
+        """
+        params = {"q": self._match(query), "user_id": user_id, "limit": limit, "offset": offset}
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        keys = ("id", "ticket_id", "sender_id", "receiver_id", "snippet", "score")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def search_tickets(self, query, limit, offset, user_id=None):
+        scope = "AND creator_id = :user_id" if user_id is not None else ""
+        sql = f"""
+            SELECT rowid, title, creator_id,
+                   snippet(tickets_fts, -1, '[', ']', '...', 16), -bm25(tickets_fts) AS score
+            FROM tickets_fts
+            WHERE tickets_fts MATCH :q {scope}
+            ORDER BY bm25(tickets_fts)
+            LIMIT :limit OFFSET :offset
+        """
+        params = {"q": self._match(query), "user_id": user_id, "limit": limit, "offset": offset}
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        keys = ("id", "title", "creator_id", "snippet", "score")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def rebuild(self, batch_size: int = 5000):
+        with self.lock:
+            self.conn.execute("DELETE FROM messages_fts")
+            self.conn.execute("DELETE FROM tickets_fts")
+            self.conn.commit()
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(
+                text("SELECT id, content, ticket_id, sender_id, receiver_id FROM messages ORDER BY id")
+            )
+            for chunk in result.mappings().partitions(batch_size):
+                self.index_messages([dict(row) for row in chunk])
+            for row in conn.execute(text("SELECT id, title, description, creator_id FROM tickets")):
+                self.index_ticket(*row)
+
+
+def create_search_backend() -> SearchBackend:
+    backend = settings.SEARCH_BACKEND
+    if backend == "auto":
+        backend = "mysql" if engine.dialect.name == "mysql" else "fts5"
+    if backend == "mysql":
+        return MySQLFullTextSearch()
+    if backend == "fts5":
+        return SQLiteFTSSearch(settings.SEARCH_INDEX_PATH)
+    raise ValueError(f"Unknown search backend: {settings.SEARCH_BACKEND}")
+
+
+search_index = create_search_backend()
+
+
+if __name__ == "__main__":
+    if isinstance(search_index, SQLiteFTSSearch):
+        search_index.rebuild()
+        print("search index rebuilt")
+    else:
+        print("MySQL FULLTEXT indexes are maintained by the database; nothing to rebuild")
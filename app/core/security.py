@@ -1,7 +1,15 @@
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+import asyncio
+import hashlib
+import os
+import time
 from app.core.config import settings
+from app.core.cache import TTLCache
+from app.core.metrics import Histogram
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -15,6 +23,81 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+def verify_and_update_password(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    # Returns a replacement hash when the stored one uses deprecated settings.
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+password_hash_wait = Histogram("password_hash_wait_seconds", "Time a hash/verify job waited for a pool slot.", ("op",))
+password_hash_run = Histogram("password_hash_run_seconds", "Time a hash/verify job spent in the process pool.", ("op",))
+
+class PasswordHasher:
+    # bcrypt is pure CPU, so it runs in a process pool rather than the
+    # threadpool. The semaphore caps how many jobs are handed to the pool;
+    # callers beyond that wait on the loop and show up as queue depth.
+
+    def __init__(self, workers: int, max_concurrency: int):
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def _run(self, op: str, func, *args):
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        started = time.perf_counter()
+        self.wait_seconds += started - queued
+        password_hash_wait.observe(started - queued, op)
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.semaphore.release()
+            self.in_flight -= 1
+            self.completed += 1
+            elapsed = time.perf_counter() - started
+            self.run_seconds += elapsed
+            password_hash_run.observe(elapsed, op)
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", get_password_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self._run("verify", verify_and_update_password, plain_password, hashed_password)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.waiting,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "wait_seconds": round(self.wait_seconds, 6),
+            "run_seconds": round(self.run_seconds, 6),
+        }
+
+_hash_workers = settings.PASSWORD_HASH_WORKERS or os.cpu_count() or 1
+password_hasher = PasswordHasher(_hash_workers, settings.PASSWORD_HASH_MAX_CONCURRENCY or 2 * _hash_workers)
+
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -22,9 +105,19 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# Verified payloads keyed by token digest, each kept until the token's exp.
+token_cache = TTLCache("tokens", settings.TOKEN_CACHE_MAXSIZE, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
 def decode_access_token(token: str):
+    key = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(key)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except JWTError:
-        return None 
\ No newline at end of file
+        return None
+    ttl = payload.get("exp", 0) - time.time()
+    if ttl > 0:
+        token_cache.set(key, payload, ttl)
+    return payload 
\ No newline at end of file
@@ -0,0 +1,382 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from app.core.broker import broker
+from app.core.cache import aget_ticket_routing
+from app.core.config import settings
+from app.core.metrics import Counter, Histogram
+from app.core.protocol import event
+
+logger = logging.getLogger(__name__)
+
+# Call state lives in the broker so every worker sees the same view:
+#   calls:       call_id   -> {'kind': 'direct'|'ticket', 'state', 'caller', 'created',
+#                              'devices': {user_id: device}, 'callee' | 'ticket_id'}
+#   user_call:   user_id   -> {'state': 'ringing'|'in_call', 'call_id'}   (absent = idle)
+#   ticket_call: ticket_id -> {'state': 'ringing'|'in_call', 'call_id'}  (absent = idle)
+#   call_frames: call_id   -> signaling frames relayed so far
+IDLE, RINGING, IN_CALL = "idle", "ringing", "in_call"
+SWEEP_INTERVAL = 5  # seconds between checks for unanswered calls
+
+call_setup = Histogram("call_setup_seconds", "Invite to answer (direct) or first join (ticket).", ("kind",),
+                       buckets=(0.5, 1, 2, 3, 5, 8, 13, 21, 34, 60))
+calls_ended = Counter("calls_total", "Calls by kind and how they ended.", ("kind", "outcome"))
+call_frames = Histogram("call_signaling_frames", "Signaling frames relayed per call.", ("kind",),
+                        buckets=(5, 10, 20, 50, 100, 200, 500, 1000))
+ice_candidates = Counter("ice_candidates_total", "Trickle-ICE candidates relayed.")
+ice_frames = Counter("ice_frames_total", "Frames carrying ICE candidates after coalescing.")
+
+# publish(user_id, event, to_device, except_device)
+Publisher = Callable[[int, dict, Optional[str], Optional[str]], Awaitable[None]]
+
+
+def new_call_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def _as_id(value) -> Optional[int]:
+    # A user or ticket id from a client frame, or None if it isn't one.
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class SignalingService:
+    # Call state machine and relay for WebRTC signaling.
+    #
+    # Direct calls: invite rings every device of the callee; the first device
+    # to answer is pinned for the rest of the call and the others are told it
+    # was answered elsewhere. reject/hangup, or the pinned device going away,
+    # return both users to idle.
+    #
+    # Ticket calls: invite rings the ticket room; members join and leave a
+    # full mesh, exchanging offers/answers with "signal" frames addressed to
+    # a participant. The call ends when fewer than two participants remain.
+    #
+    # Trickle-ICE candidates for the same target arriving within ICE_COALESCE_MS
+    # are sent together in one frame.
+    #
+    # Calls nobody answers within CALL_RING_TIMEOUT_SECONDS are ended as
+    # missed by one worker's sweep, which also covers calls whose caller's
+    # worker died mid-ring.
+
+    def __init__(self, ice_window: float, ring_timeout: float):
+        self.ice_window = ice_window
+        self.ring_timeout = ring_timeout
+        self.publish: Optional[Publisher] = None
+        self.ice_buffers: Dict[Tuple[int, Optional[str], str, int], List] = {}
+        self.flushes: Set[asyncio.Task] = set()
+        self.task: Optional[asyncio.Task] = None
+
+    def set_publisher(self, publish: Publisher):
+        self.publish = publish
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            if not broker.leads():
+                continue
+            try:
+                await self.expire_unanswered()
+            except Exception:
+                logger.exception("call sweep failed")
+
+    async def expire_unanswered(self):
+        cutoff = time.time() - self.ring_timeout
+        for call_id, call in broker.items("calls"):
+            if call["state"] == RINGING and call["created"] < cutoff:
+                await self._end(call_id, call, "missed", None)
+
+    # --- state helpers --------------------------------------------------
+
+    def user_state(self, user_id: int) -> dict:
+        return self._live(broker.get("user_call", user_id))
+
+    @staticmethod
+    def _live(state: Optional[dict]) -> dict:
+        # A call record is dropped with the worker that last wrote it, so a
+        # pointer to a call that no longer exists means idle.
+        if state is None or broker.get("calls", state["call_id"]) is None:
+            return {"state": IDLE}
+        return state
+
+    def _set_users(self, user_ids, state: str, call_id: str):
+        for user_id in user_ids:
+            broker.set("user_call", user_id, {"state": state, "call_id": call_id})
+
+    def _count_frame(self, call_id: Optional[str], n: int = 1):
+        if call_id:
+            broker.incr("call_frames", call_id, n)
+
+    async def _send(self, user_id: int, payload: dict, to_device: Optional[str] = None,
+                    except_device: Optional[str] = None):
+        await self.publish(user_id, payload, to_device, except_device)
+
+    async def _error(self, user_id: int, device: str, reason: str, call_id: Optional[str] = None):
+        await self._send(user_id, event("call_error", reason=reason, call_id=call_id), device)
+
+    def _participants(self, call: dict) -> List[int]:
+        return [int(user_id) for user_id in call["devices"]]
+
+    async def _in_ticket(self, user_id: int, ticket_id: int) -> bool:
+        if user_id in broker.smembers("ticket_users", ticket_id):
+            return True
+        ticket = await aget_ticket_routing(ticket_id)
+        return ticket is not None and user_id in (ticket["creator_id"], ticket["assignee_id"])
+
+    async def _end(self, call_id: str, call: dict, outcome: str, by: Optional[int], by_device: Optional[str] = None):
+        # Everyone involved is told, including the ender's other devices
+        # (which may still be ringing); by is None for a timeout.
+        broker.delete("calls", call_id)
+        if call["kind"] == "ticket":
+            broker.delete("ticket_call", call["ticket_id"])
+        if call["kind"] == "direct":
+            users = {call["caller"], call["callee"]}
+        else:
+            users = set(self._participants(call))
+            if call["state"] == RINGING:
+                users |= broker.smembers("ticket_users", call["ticket_id"])
+        for user_id in users:
+            if (broker.get("user_call", user_id) or {}).get("call_id") == call_id:
+                broker.delete("user_call", user_id)
+            await self._send(user_id, event("call", action="ended", call_id=call_id, reason=outcome, by=by),
+                             except_device=by_device if user_id == by else None)
+        calls_ended.inc(1, call["kind"], outcome)
+        call_frames.observe(broker.get("call_frames", call_id, 0), call["kind"])
+        broker.delete("call_frames", call_id)
+
+    # --- client actions -------------------------------------------------
+
+    async def handle(self, user_id: int, device: str, peer_id: int, message: dict):
+        kind = message.get("type")
+        if kind == "call":
+            action = message.get("action")
+            handler = getattr(self, f"_on_{action}", None) if action in (
+                "invite", "answer", "reject", "hangup", "join", "leave"
+            ) else None
+            if handler is None:
+                await self._error(user_id, device, "unknown_action")
+                return
+            await handler(user_id, device, peer_id, message)
+        elif kind == "signal":
+            await self._relay(user_id, device, peer_id, message)
+        elif kind == "ice":
+            await self._buffer_ice(user_id, device, peer_id, message)
+
+    async def _on_invite(self, user_id, device, peer_id, message):
+        ticket_id = message.get("ticket_id")
+        if ticket_id is not None:
+            ticket_id = _as_id(ticket_id)
+            if ticket_id is None:
+                await self._error(user_id, device, "bad_request")
+                return
+            if not await self._in_ticket(user_id, ticket_id):
+                await self._error(user_id, device, "forbidden")
+                return
+        if self.user_state(user_id)["state"] != IDLE:
+            await self._error(user_id, device, "already_in_call")
+            return
+        call_id = new_call_id()
+        if ticket_id is not None:
+            ongoing = self._live(broker.get("ticket_call", ticket_id))
+            if ongoing["state"] != IDLE:
+                await self._error(user_id, device, "busy", call_id=ongoing["call_id"])
+                return
+            call = {"kind": "ticket", "ticket_id": ticket_id, "state": RINGING, "caller": user_id,
+                    "created": time.time(), "devices": {str(user_id): device}}
+            broker.set("calls", call_id, call)
+            broker.set("ticket_call", ticket_id, {"state": RINGING, "call_id": call_id})
+            self._set_users([user_id], RINGING, call_id)
+            invite = event("call", action="invite", call_id=call_id, ticket_id=ticket_id, caller=user_id)
+            for member in broker.smembers("ticket_users", ticket_id) - {user_id}:
+                await self._send(member, invite)
+        else:
+            if self.user_state(peer_id)["state"] != IDLE:
+                await self._error(user_id, device, "busy")
+                return
+            call = {"kind": "direct", "state": RINGING, "caller": user_id, "callee": peer_id,
+                    "created": time.time(), "devices": {str(user_id): device}}
+            broker.set("calls", call_id, call)
+            self._set_users([user_id, peer_id], RINGING, call_id)
+            self._count_frame(call_id)
+            await self._send(peer_id, event(
+                "call", action="invite", call_id=call_id, caller=user_id, sdp=message.get("sdp"),
+            ))
+        await self._send(user_id, event("call", action="ringing", call_id=call_id), device)
+
+    def _call_for(self, user_id: int, message: dict) -> Tuple[Optional[str], Optional[dict]]:
+        call_id = message.get("call_id") or self.user_state(user_id).get("call_id")
+        call = broker.get("calls", call_id) if call_id else None
+        if call and call["kind"] == "direct" and user_id not in (call["caller"], call["callee"]):
+            call = None
+        return call_id, call
+
+    async def _on_answer(self, user_id, device, peer_id, message):
+        call_id, call = self._call_for(user_id, message)
+        if not call or call["kind"] != "direct" or call["callee"] != user_id or call["state"] != RINGING:
+            await self._error(user_id, device, "no_call", call_id)
+            return
+        call = dict(call, state=IN_CALL, devices=dict(call["devices"], **{str(user_id): device}))
+        broker.set("calls", call_id, call)
+        self._set_users([call["caller"], user_id], IN_CALL, call_id)
+        call_setup.observe(time.time() - call["created"], "direct")
+        self._count_frame(call_id)
+        await self._send(call["caller"], event(
+            "call", action="answer", call_id=call_id, callee=user_id, sdp=message.get("sdp"),
+        ), call["devices"][str(call["caller"])])
+        await self._send(user_id, event("call", action="answered_elsewhere", call_id=call_id), except_device=device)
+
+    async def _on_reject(self, user_id, device, peer_id, message):
+        call_id, call = self._call_for(user_id, message)
+        if not call or call["kind"] != "direct" or call["callee"] != user_id or call["state"] != RINGING:
+            await self._error(user_id, device, "no_call", call_id)
+            return
+        await self._end(call_id, call, "rejected", user_id, device)
+
+    async def _on_hangup(self, user_id, device, peer_id, message):
+        call_id, call = self._call_for(user_id, message)
+        if not call:
+            await self._error(user_id, device, "no_call", call_id)
+            return
+        if call["kind"] == "ticket":
+            await self._on_leave(user_id, device, peer_id, message)
+            return
+        outcome = "completed" if call["state"] == IN_CALL else "cancelled"
+        await self._end(call_id, call, outcome, user_id, device)
+
+    async def _on_join(self, user_id, device, peer_id, message):
+        call_id, call = self._call_for(user_id, message)
+        if not call or call["kind"] != "ticket":
+            await self._error(user_id, device, "no_call", call_id)
+            return
+        if not await self._in_ticket(user_id, call["ticket_id"]):
+            await self._error(user_id, device, "forbidden", call_id)
+            return
+        if self.user_state(user_id).get("call_id") not in (None, call_id):
+            await self._error(user_id, device, "already_in_call")
+            return
+        existing = self._participants(call)
+        if call["state"] == RINGING:
+            call_setup.observe(time.time() - call["created"], "ticket")
+        call = dict(call, state=IN_CALL, devices=dict(call["devices"], **{str(user_id): device}))
+        broker.set("calls", call_id, call)
+        broker.set("ticket_call", call["ticket_id"], {"state": IN_CALL, "call_id": call_id})
+        self._set_users(self._participants(call), IN_CALL, call_id)
+        await self._send(user_id, event("call", action="joined", call_id=call_id, participants=existing), device)
+        for participant in existing:
+            if participant != user_id:
+                await self._send(participant, event("call", action="participant_joined", call_id=call_id,
+                                                    user_id=user_id), call["devices"][str(participant)])
+
+    async def _on_leave(self, user_id, device, peer_id, message):
+        call_id, call = self._call_for(user_id, message)
+        if not call or call["kind"] != "ticket" or str(user_id) not in call["devices"]:
+            await self._error(user_id, device, "no_call", call_id)
+            return
+        devices = {k: v for k, v in call["devices"].items() if k != str(user_id)}
+        if not devices or (len(devices) < 2 and call["state"] == IN_CALL):
+            await self._end(call_id, dict(call, devices=devices), "completed", user_id, device)
+            broker.delete("user_call", user_id)
+            return
+        broker.set("calls", call_id, dict(call, devices=devices))
+        broker.delete("user_call", user_id)
+        for participant, participant_device in devices.items():
+            await self._send(int(participant), event("call", action="participant_left", call_id=call_id,
+                                                     user_id=user_id), participant_device)
+
+    # --- relay ----------------------------------------------------------
+
+    def _route(self, user_id: int, peer_id: int, message: dict) -> Tuple[Optional[int], Optional[str], Optional[str]]:
+        # Target user and device for an SDP/ICE frame: an explicit "to", else
+        # the other party of a direct call, else the socket's peer. Frames
+        # inside a call go to the device pinned for that call. The target is
+        # None if "to" isn't a user id.
+        call_id, call = self._call_for(user_id, message)
+        if call and call["kind"] == "ticket" and str(user_id) not in call["devices"]:
+            call = None
+        target = message.get("to")
+        if target is None:
+            target = call["callee"] if call and call["kind"] == "direct" and call["caller"] == user_id else (
+                call["caller"] if call and call["kind"] == "direct" else peer_id
+            )
+        target = _as_id(target)
+        if target is None:
+            return None, None, None
+        device = call["devices"].get(str(target)) if call else None
+        return target, device, call_id if call else None
+
+    async def _relay(self, user_id, device, peer_id, message):
+        target, to_device, call_id = self._route(user_id, peer_id, message)
+        if target is None:
+            await self._error(user_id, device, "bad_request")
+            return
+        self._count_frame(call_id)
+        await self._send(target, event("signal", sender_id=user_id, call_id=call_id, data=message.get("data")), to_device)
+
+    async def _buffer_ice(self, user_id, device, peer_id, message):
+        target, to_device, call_id = self._route(user_id, peer_id, message)
+        candidates = message.get("candidates")
+        if candidates is None:
+            candidates = [message.get("candidate")]
+        if target is None or not isinstance(candidates, list):
+            await self._error(user_id, device, "bad_request")
+            return
+        key = (target, to_device, call_id or "", user_id)
+        buffer = self.ice_buffers.get(key)
+        if buffer is None:
+            buffer = self.ice_buffers[key] = []
+            asyncio.get_running_loop().call_later(self.ice_window, self._schedule_ice_flush, key)
+        buffer.extend(candidates)
+        ice_candidates.inc(len(candidates))
+
+    def _schedule_ice_flush(self, key):
+        task = asyncio.create_task(self._flush_ice(key))
+        self.flushes.add(task)
+        task.add_done_callback(self.flushes.discard)
+
+    async def _flush_ice(self, key):
+        candidates = self.ice_buffers.pop(key, None)
+        if not candidates:
+            return
+        target, to_device, call_id, sender = key
+        self._count_frame(call_id or None)
+        ice_frames.inc()
+        try:
+            await self._send(target, event("ice", sender_id=sender, call_id=call_id or None, candidates=candidates), to_device)
+        except Exception:
+            logger.exception("failed to relay ICE candidates")
+
+    # --- connection lifecycle -------------------------------------------
+
+    async def device_gone(self, user_id: int, device: str):
+        # A device dropping out ends whatever it was pinned to; a ringing
+        # callee device going away doesn't, the others keep ringing.
+        state = self.user_state(user_id)
+        call_id = state.get("call_id")
+        call = broker.get("calls", call_id) if call_id else None
+        if call is None:
+            return
+        if call["devices"].get(str(user_id)) != device:
+            return
+        message = {"call_id": call_id}
+        if call["kind"] == "ticket":
+            await self._on_leave(user_id, device, 0, message)
+        else:
+            await self._end(call_id, call, "disconnected", user_id, device)
+
+
+signaling = SignalingService(settings.ICE_COALESCE_MS / 1000, settings.CALL_RING_TIMEOUT_SECONDS)
@@ -0,0 +1,214 @@
+import math
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.cache import TTLCache
+from app.models.message import Message
+from app.models.stats import SlaHistogram, TicketQueueCount
+from app.models.ticket import Ticket, TicketStatus
+
+FIRST_RESPONSE = "first_response"
+RESOLUTION = "resolution"
+
+# SLA durations are counted in log-linear buckets: bucket 0 holds anything
+# under MIN_SECONDS, then every doubling is split into BUCKETS_PER_OCTAVE
+# buckets (each about 9% wide) up to 2^31 seconds. Percentiles interpolate
+# within a bucket, so they are off by a few percent at most.
+MIN_SECONDS = 2 ** -6
+BUCKETS_PER_OCTAVE = 8
+MAX_BUCKET = 37 * BUCKETS_PER_OCTAVE
+
+# Tickets already known to have a first response, so their later messages
+# skip the UPDATE entirely.
+_responded = TTLCache("responded_tickets", 100000, 24 * 3600)
+
+QueueKey = Tuple[int, str, str]
+
+
+def _value(enum_or_str) -> str:
+    return getattr(enum_or_str, "value", enum_or_str)
+
+
+def queue_key(ticket: Ticket) -> QueueKey:
+    return (ticket.assignee_id or 0, _value(ticket.priority), _value(ticket.status))
+
+
+def _seconds_between(start: datetime, end: datetime) -> float:
+    # MySQL hands back naive datetimes; treat everything as UTC.
+    if start.tzinfo is not None:
+        start = start.astimezone(timezone.utc).replace(tzinfo=None)
+    if end.tzinfo is not None:
+        end = end.astimezone(timezone.utc).replace(tzinfo=None)
+    return max((end - start).total_seconds(), 0.0)
+
+
+def _bucket(seconds: float) -> int:
+    if seconds < MIN_SECONDS:
+        return 0
+    return min(int(math.log2(seconds / MIN_SECONDS) * BUCKETS_PER_OCTAVE) + 1, MAX_BUCKET)
+
+
+def _bounds(bucket: int) -> Tuple[float, float]:
+    if bucket == 0:
+        return 0.0, MIN_SECONDS
+    return (MIN_SECONDS * 2 ** ((bucket - 1) / BUCKETS_PER_OCTAVE),
+            MIN_SECONDS * 2 ** (bucket / BUCKETS_PER_OCTAVE))
+
+
+def _bump(db: Session, model, keys: dict, delta: int):
+    query = db.query(model).filter_by(**keys)
+    if query.update({model.count: model.count + delta}, synchronize_session=False):
+        return
+    try:
+        with db.begin_nested():
+            db.add(model(count=delta, **keys))
+    except IntegrityError:
+        query.update({model.count: model.count + delta}, synchronize_session=False)
+
+
+def _bump_queue(db: Session, key: QueueKey, delta: int):
+    assignee_id, priority, status = key
+    _bump(db, TicketQueueCount, {"assignee_id": assignee_id, "priority": priority, "status": status}, delta)
+
+
+def _record_sla(db: Session, metric: str, priority: str, seconds: float):
+    _bump(db, SlaHistogram, {"metric": metric, "priority": priority, "bucket": _bucket(seconds)}, 1)
+
+
+def apply_ticket_created(db: Session, ticket: Ticket):
+    _bump_queue(db, queue_key(ticket), 1)
+
+
+def apply_ticket_change(db: Session, before: QueueKey, ticket: Ticket):
+    # Call after the ticket has been flushed and refreshed, inside the same
+    # transaction as the change itself.
+    after = queue_key(ticket)
+    if after != before:
+        _bump_queue(db, before, -1)
+        _bump_queue(db, after, 1)
+    if before[2] != TicketStatus.CLOSED.value and after[2] == TicketStatus.CLOSED.value and ticket.created_at and ticket.closed_at:
+        _record_sla(db, RESOLUTION, after[1], _seconds_between(ticket.created_at, ticket.closed_at))
+
+
+def record_first_responses(db: Session, rows: List[dict]) -> List[int]:
+    # Called in the message insert transaction. The first message on a
+    # ticket from anyone but its creator stamps first_response_at. Returns
+    # the tickets now known to have a first response, for mark_responded()
+    # once the transaction has committed.
+    ticket_ids = {row["ticket_id"] for row in rows if row.get("ticket_id") and not _responded.get(row["ticket_id"])}
+    if not ticket_ids:
+        return []
+    tickets = {
+        ticket.id: ticket for ticket in db.query(
+            Ticket.id, Ticket.creator_id, Ticket.created_at, Ticket.priority, Ticket.first_response_at
+        ).filter(Ticket.id.in_(ticket_ids))
+    }
+    responded = [ticket_id for ticket_id, ticket in tickets.items() if ticket.first_response_at is not None]
+    for row in rows:
+        ticket = tickets.get(row.get("ticket_id"))
+        if ticket is None or ticket.id in responded or row["sender_id"] == ticket.creator_id:
+            continue
+        responded.append(ticket.id)
+        updated = db.query(Ticket).filter(
+            Ticket.id == ticket.id, Ticket.first_response_at.is_(None)
+        ).update({Ticket.first_response_at: row["timestamp"]}, synchronize_session=False)
+        if updated and ticket.created_at:
+            _record_sla(db, FIRST_RESPONSE, _value(ticket.priority), _seconds_between(ticket.created_at, row["timestamp"]))
+    return responded
+
+
+def mark_responded(ticket_ids: List[int]):
+    for ticket_id in ticket_ids:
+        _responded.set(ticket_id, True)
+
+
+def queue_counts(db: Session) -> List[dict]:
+    rows = db.query(TicketQueueCount).filter(TicketQueueCount.count > 0).all()
+    return [
+        {"assignee_id": row.assignee_id or None, "priority": row.priority, "status": row.status, "count": row.count}
+        for row in rows
+    ]
+
+
+def _percentile(buckets: Counter, fraction: float) -> Optional[float]:
+    total = sum(buckets.values())
+    if not total:
+        return None
+    rank = fraction * total
+    seen = 0
+    for bucket in sorted(buckets):
+        count = buckets[bucket]
+        if seen + count >= rank:
+            low, high = _bounds(bucket)
+            return round(low + (high - low) * (rank - seen) / count, 3)
+        seen += count
+    return None
+
+
+def sla_summary(db: Session) -> Dict[str, dict]:
+    histograms: Dict[str, Dict[str, Counter]] = {}
+    for row in db.query(SlaHistogram).filter(SlaHistogram.count > 0):
+        per_priority = histograms.setdefault(row.metric, {})
+        per_priority.setdefault(row.priority, Counter())[row.bucket] += row.count
+        per_priority.setdefault("ALL", Counter())[row.bucket] += row.count
+    summary = {}
+    for metric in (FIRST_RESPONSE, RESOLUTION):
+        summary[metric] = {
+            priority: {
+                "count": sum(buckets.values()),
+                "median_seconds": _percentile(buckets, 0.5),
+                "p90_seconds": _percentile(buckets, 0.9),
+            }
+            for priority, buckets in histograms.get(metric, {}).items()
+        }
+    return summary
+
+
+def rebuild(db: Session):
+    db.query(TicketQueueCount).delete(synchronize_session=False)
+    db.query(SlaHistogram).delete(synchronize_session=False)
+    grouped = db.query(
+        Ticket.assignee_id, Ticket.priority, Ticket.status, func.count(Ticket.id)
+    ).group_by(Ticket.assignee_id, Ticket.priority, Ticket.status)
+    counts: Counter = Counter()
+    for assignee_id, priority, status, count in grouped:
+        counts[(assignee_id or 0, _value(priority), _value(status))] += count
+    for (assignee_id, priority, status), count in counts.items():
+        db.add(TicketQueueCount(assignee_id=assignee_id, priority=priority, status=status, count=count))
+
+    first_reply = db.query(
+        Message.ticket_id, func.min(Message.timestamp).label("first_at")
+    ).join(Ticket, Ticket.id == Message.ticket_id).filter(
+        Message.sender_id != Ticket.creator_id
+    ).group_by(Message.ticket_id).subquery()
+    db.query(Ticket).filter(Ticket.id == first_reply.c.ticket_id).update(
+        {Ticket.first_response_at: first_reply.c.first_at}, synchronize_session=False
+    )
+    histogram: Counter = Counter()
+    for created_at, first_response_at, closed_at, priority in db.query(
+        Ticket.created_at, Ticket.first_response_at, Ticket.closed_at, Ticket.priority
+    ).execution_options(yield_per=5000):
+        if created_at and first_response_at:
+            histogram[(FIRST_RESPONSE, _value(priority), _bucket(_seconds_between(created_at, first_response_at)))] += 1
+        if created_at and closed_at:
+            histogram[(RESOLUTION, _value(priority), _bucket(_seconds_between(created_at, closed_at)))] += 1
+    for (metric, priority, bucket), count in histogram.items():
+        db.add(SlaHistogram(metric=metric, priority=priority, bucket=bucket, count=count))
+    db.commit()
+    _responded.clear()
+
+
+if __name__ == "__main__":
+    from app.core.database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        rebuild(session)
+    finally:
+        session.close()
+    print("ticket statistics rebuilt")
@@ -0,0 +1,115 @@
+from typing import Dict, List, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.message import Message
+from app.models.read_state import ReadWatermark
+from app.models.ticket import Ticket
+
+
+def dm_conversation(peer_id: int) -> str:
+    return f"dm:{peer_id}"
+
+
+def ticket_conversation(ticket_id: int) -> str:
+    return f"ticket:{ticket_id}"
+
+
+def _incoming_filter(user_id: int, conversation: str):
+    kind, key = conversation.split(":", 1)
+    if kind == "dm":
+        return (Message.sender_id == int(key)) & (Message.receiver_id == user_id)
+    return (Message.ticket_id == int(key)) & (Message.sender_id != user_id)
+
+
+def _recipients(db: Session, rows: List[dict]) -> Dict[Tuple[int, str], List[int]]:
+    # (user_id, conversation) -> ids of the rows that are unread for them.
+    ids: Dict[Tuple[int, str], List[int]] = {}
+    ticket_ids = {row["ticket_id"] for row in rows if row.get("ticket_id")}
+    participants: Dict[int, set] = {}
+    if ticket_ids:
+        query = db.query(Ticket.id, Ticket.creator_id, Ticket.assignee_id).filter(Ticket.id.in_(ticket_ids))
+        for ticket_id, creator_id, assignee_id in query:
+            participants[ticket_id] = {creator_id, assignee_id} - {None}
+    for row in rows:
+        if row.get("read"):
+            continue
+        if row.get("ticket_id"):
+            conversation = ticket_conversation(row["ticket_id"])
+            for user_id in participants.get(row["ticket_id"], ()):
+                if user_id != row["sender_id"]:
+                    ids.setdefault((user_id, conversation), []).append(row["id"])
+        elif row.get("receiver_id") and row["receiver_id"] != row["sender_id"]:
+            ids.setdefault((row["receiver_id"], dm_conversation(row["sender_id"])), []).append(row["id"])
+    return ids
+
+
+def _bump(db: Session, user_id: int, conversation: str, ids: List[int]):
+    watermark = db.query(ReadWatermark).filter(
+        ReadWatermark.user_id == user_id, ReadWatermark.conversation == conversation
+    )
+    # Usual case: the whole batch is above the reader's watermark.
+    if watermark.filter(ReadWatermark.last_read_id < min(ids)).update(
+        {ReadWatermark.unread_count: ReadWatermark.unread_count + len(ids)}, synchronize_session=False
+    ):
+        return
+    last_read_id = db.query(ReadWatermark.last_read_id).filter(
+        ReadWatermark.user_id == user_id, ReadWatermark.conversation == conversation
+    ).with_for_update().scalar()
+    if last_read_id is None:
+        try:
+            with db.begin_nested():
+                db.add(ReadWatermark(user_id=user_id, conversation=conversation, last_read_id=0, unread_count=len(ids)))
+            return
+        except IntegrityError:
+            # Created concurrently by another writer or a mark_read.
+            last_read_id = db.query(ReadWatermark.last_read_id).filter(
+                ReadWatermark.user_id == user_id, ReadWatermark.conversation == conversation
+            ).with_for_update().scalar()
+    count = sum(1 for message_id in ids if message_id > last_read_id)
+    if count:
+        watermark.update({ReadWatermark.unread_count: ReadWatermark.unread_count + count}, synchronize_session=False)
+
+
+def record_unread(db: Session, rows: List[dict]):
+    # Called in the same transaction that inserts the messages. Only rows
+    # above the recipient's watermark count: with write-behind, a client can
+    # mark a message read before its row is flushed. Recipients are locked
+    # in order so concurrent batches can't deadlock.
+    for (user_id, conversation), ids in sorted(_recipients(db, rows).items()):
+        _bump(db, user_id, conversation, ids)
+
+
+def mark_read(db: Session, user_id: int, conversation: str, up_to_id: int) -> ReadWatermark:
+    query = db.query(ReadWatermark).filter(
+        ReadWatermark.user_id == user_id, ReadWatermark.conversation == conversation
+    ).with_for_update()
+    watermark = query.first()
+    if watermark is None:
+        try:
+            with db.begin_nested():
+                watermark = ReadWatermark(user_id=user_id, conversation=conversation, last_read_id=0, unread_count=0)
+                db.add(watermark)
+        except IntegrityError:
+            # Created concurrently by another mark_read or a message flush.
+            watermark = query.one()
+    if up_to_id <= watermark.last_read_id:
+        return watermark
+    # Whatever is left above the new watermark is a short index range.
+    watermark.last_read_id = up_to_id
+    watermark.unread_count = db.query(func.count(Message.id)).filter(
+        _incoming_filter(user_id, conversation), Message.id > up_to_id
+    ).scalar()
+    db.commit()
+    db.refresh(watermark)
+    return watermark
+
+
+def unread_counts(db: Session, user_id: int) -> Tuple[int, Dict[str, int]]:
+    rows = db.query(ReadWatermark.conversation, ReadWatermark.unread_count).filter(
+        ReadWatermark.user_id == user_id, ReadWatermark.unread_count > 0
+    ).all()
+    conversations = {conversation: count for conversation, count in rows}
+    return sum(conversations.values()), conversations
@@ -1,21 +1,66 @@
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
-from app.routers import auth, ticket, message, ws_chat
+from fastapi.responses import JSONResponse, Response
+from app.routers import auth, ticket, message, ws_chat, avatar, search
+from app.core.broker import broker
+from app.core.message_queue import message_writer
+from app.core.delivery import delivery_log
+from app.core.presence import presence
+from app.core.signaling import signaling
+from app.core.connections import registry as connection_registry
+from app.core.cache import cache_stats
+from app.core.security import password_hasher
+from app.core.images import image_processor
+from app.core.metrics import CONTENT_TYPE, MetricsMiddleware, registry
+from app.core.config import settings
 from fastapi.staticfiles import StaticFiles
 import os
 
 app = FastAPI()
 
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+@app.on_event("startup")
+async def start_background_services():
+    await broker.start()
+    await message_writer.start()
+    await delivery_log.start()
+    await presence.start()
+    await signaling.start()
+    await connection_registry.start()
+
+@app.on_event("shutdown")
+async def stop_background_services():
+    # Flush pending messages before the process goes away.
+    await connection_registry.stop()
+    await signaling.stop()
+    await presence.stop()
+    await message_writer.stop()
+    await delivery_log.stop()
+    await broker.stop()
+    password_hasher.shutdown()
+    image_processor.shutdown()
+
 app.include_router(auth.router)
 app.include_router(ticket.router)
 app.include_router(message.router)
 app.include_router(ws_chat.router)
+app.include_router(avatar.router)
+app.include_router(search.router)
 
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
+@app.get("/api/cache/stats")
+def get_cache_stats():
+    return cache_stats()
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
 @app.get("/", response_class=JSONResponse)
 def read_root(request: Request):
     return {"message": "Welcome to the backend API. No frontend available."} 
\ No newline at end of file
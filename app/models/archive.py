@@ -0,0 +1,37 @@
+from sqlalchemy import Column, Integer, DateTime, LargeBinary, ForeignKey, Index
+from sqlalchemy.dialects import mysql
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+class MessageSegment(Base):
+    # Cold tier of the messages table: a run of archived messages from one
+    # conversation (a ticket, or the DMs between user_low and user_high),
+    # stored compressed and never modified. The other columns are the
+    # segment's index, so reads only decompress segments they need.
+    __tablename__ = "message_segments"
+
+    id = Column(Integer, primary_key=True)
+    ticket_id = Column(Integer, nullable=True)
+    user_low = Column(Integer, nullable=True)
+    user_high = Column(Integer, nullable=True)
+    first_id = Column(Integer, nullable=False)
+    last_id = Column(Integer, nullable=False)
+    first_at = Column(DateTime(timezone=True), nullable=True)
+    last_at = Column(DateTime(timezone=True), nullable=True)
+    count = Column(Integer, nullable=False)
+    data = Column(LargeBinary().with_variant(mysql.LONGBLOB(), "mysql"), nullable=False)  # zlib-compressed JSON rows
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_message_segments_ticket_id_last_id", "ticket_id", "last_id"),
+        Index("ix_message_segments_user_low_last_id", "user_low", "last_id"),
+        Index("ix_message_segments_user_high_last_id", "user_high", "last_id"),
+    )
+
+class MessageSegmentUser(Base):
+    # Everyone who sent or received a message in a segment, so a user's
+    # history can find their archived ticket messages too.
+    __tablename__ = "message_segment_users"
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    segment_id = Column(Integer, ForeignKey("message_segments.id", ondelete="CASCADE"), primary_key=True)
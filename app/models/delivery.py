@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, BigInteger, Text, DateTime, Index
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+class DeliveryCursor(Base):
+    # Last sequence number handed out in each user's delivery log.
+    __tablename__ = "delivery_cursors"
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    last_seq = Column(BigInteger, nullable=False, default=0)
+
+class DeliveryEntry(Base):
+    # Events published to a user's channel, kept (bounded by TTL and count)
+    # so a reconnecting client can fetch just what it missed.
+    __tablename__ = "delivery_log"
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    seq = Column(BigInteger, primary_key=True, autoincrement=False)
+    event = Column(Text, nullable=False)  # JSON-encoded protocol event
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())  # UTC, set by append_entries
+
+    __table_args__ = (
+        Index("ix_delivery_log_created_at", "created_at"),
+    )
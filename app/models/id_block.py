@@ -0,0 +1,8 @@
+from sqlalchemy import Column, String, BigInteger
+from app.core.database import Base
+
+class IdBlock(Base):
+    __tablename__ = "id_blocks"
+
+    name = Column(String(50), primary_key=True)
+    next_id = Column(BigInteger, nullable=False)
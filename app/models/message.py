@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean, Index
 from sqlalchemy.sql import func
 from app.core.database import Base
 
@@ -11,4 +11,11 @@ class Message(Base):
     ticket_id = Column(Integer, ForeignKey("tickets.id"), nullable=True)
     content = Column(Text, nullable=False)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
-    read = Column(Boolean, default=False) 
\ No newline at end of file
+    read = Column(Boolean, default=False)
+
+    __table_args__ = (
+        Index("ix_messages_ticket_id_id", "ticket_id", "id"),
+        Index("ix_messages_sender_id_receiver_id_id", "sender_id", "receiver_id", "id"),
+        Index("ix_messages_sender_id_id", "sender_id", "id"),
+        Index("ix_messages_receiver_id_id", "receiver_id", "id"),
+    )
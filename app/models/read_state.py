@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, UniqueConstraint
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+class ReadWatermark(Base):
+    __tablename__ = "read_watermarks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    conversation = Column(String(40), nullable=False)  # "dm:<peer_id>" or "ticket:<ticket_id>"
+    last_read_id = Column(Integer, nullable=False, default=0)
+    unread_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "conversation", name="uq_read_watermarks_user_id_conversation"),
+    )
@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, String
+from app.core.database import Base
+
+class TicketQueueCount(Base):
+    __tablename__ = "ticket_queue_counts"
+
+    assignee_id = Column(Integer, primary_key=True, autoincrement=False)  # 0 = unassigned
+    priority = Column(String(20), primary_key=True)
+    status = Column(String(20), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+class SlaHistogram(Base):
+    __tablename__ = "sla_histogram"
+
+    metric = Column(String(20), primary_key=True)  # "first_response" or "resolution"
+    priority = Column(String(20), primary_key=True)
+    bucket = Column(Integer, primary_key=True, autoincrement=False)  # see app.core.ticket_stats._bucket
+    count = Column(Integer, nullable=False, default=0)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Enum, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Text, Enum, ForeignKey, DateTime, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.core.database import Base
@@ -29,6 +29,24 @@ class Ticket(Base):
     assignee_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     closed_at = Column(DateTime(timezone=True), nullable=True)
+    first_response_at = Column(DateTime(timezone=True), nullable=True)
 
     creator = relationship("User", foreign_keys=[creator_id], back_populates="created_tickets")
-    assignee = relationship("User", foreign_keys=[assignee_id], back_populates="assigned_tickets") 
\ No newline at end of file
+    assignee = relationship("User", foreign_keys=[assignee_id], back_populates="assigned_tickets") 
+
+    __table_args__ = (
+        Index("ix_tickets_status_priority_created_at", "status", "priority", "created_at"),
+        Index("ix_tickets_assignee_id_status", "assignee_id", "status"),
+        Index("ix_tickets_creator_id_created_at", "creator_id", "created_at"),
+        Index("ix_tickets_created_at", "created_at"),
+    )
+
+class TicketLog(Base):
+    __tablename__ = "ticket_logs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    ticket_id = Column(Integer, ForeignKey("tickets.id"), nullable=False)
+    status_from = Column(String(20), nullable=False)
+    status_to = Column(String(20), nullable=False)
+    changed_by = Column(Integer, ForeignKey("users.id"), nullable=False)
+    timestamp = Column(DateTime(timezone=True), server_default=func.now())
@@ -1,8 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from app.models.user import User
-from app.core.security import get_password_hash, create_access_token, verify_password
-from app.core.database import SessionLocal
+from starlette.concurrency import run_in_threadpool
+from app.core.security import create_access_token, password_hasher
+from app.core.database import SessionLocal, get_db
+from app.core.deps import limit_per_ip
+from app.core.ratelimit import logins
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
@@ -17,27 +20,50 @@ class LoginRequest(BaseModel):
     email: str
     password: str
 
-@router.post("/register")
-def register(user_in: RegisterRequest):
+def _get_user_by_email(email: str):
+    # A short-lived session of its own, so no connection is held through
+    # the slow bcrypt step that follows.
     db = SessionLocal()
-    existing = db.query(User).filter(User.email == user_in.email).first()
-    if existing:
+    try:
+        return db.query(User.id, User.password_hash).filter(User.email == email).first()
+    finally:
         db.close()
+
+def _create_user(db: Session, user_in: RegisterRequest, password_hash: str):
+    if db.query(User.id).filter(User.email == user_in.email).first():
         raise HTTPException(status_code=400, detail="Email already registered")
-    user = User(name=user_in.name, email=user_in.email, password_hash=get_password_hash(user_in.password), role=user_in.role)
+    user = User(name=user_in.name, email=user_in.email, password_hash=password_hash, role=user_in.role)
     db.add(user)
     db.commit()
     db.refresh(user)
-    db.close()
+    return user
+
+def _update_password_hash(db: Session, user_id: int, password_hash: str):
+    db.query(User).filter(User.id == user_id).update({User.password_hash: password_hash})
+    db.commit()
+
+@router.post("/register")
+async def register(user_in: RegisterRequest, db: Session = Depends(get_db)):
+    existing = await run_in_threadpool(_get_user_by_email, user_in.email)
+    if existing:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    password_hash = await password_hasher.hash(user_in.password)
+    user = await run_in_threadpool(_create_user, db, user_in, password_hash)
     return {"id": user.id, "email": user.email}
 
-@router.post("/login")
-def login(login_in: LoginRequest):
-    db = SessionLocal()
-    user = db.query(User).filter(User.email == login_in.email).first()
-    if not user or not verify_password(login_in.password, user.password_hash):
-        db.close()
+@router.post("/login", dependencies=[Depends(limit_per_ip(logins))])
+async def login(login_in: LoginRequest, db: Session = Depends(get_db)):
+    user = await run_in_threadpool(_get_user_by_email, login_in.email)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    valid, new_hash = await password_hasher.verify(login_in.password, user.password_hash)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        await run_in_threadpool(_update_password_hash, db, user.id, new_hash)
     token = create_access_token({"sub": str(user.id)})
-    db.close()
-    return {"access_token": token, "token_type": "bearer"} 
\ No newline at end of file
+    return {"access_token": token, "token_type": "bearer"}
+
+@router.get("/hashing/stats")
+def password_hashing_stats():
+    return password_hasher.stats()
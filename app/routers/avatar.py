@@ -0,0 +1,57 @@
+from fastapi import APIRouter, Depends, File, HTTPException, Request, UploadFile
+from fastapi.responses import FileResponse, Response
+from starlette.concurrency import run_in_threadpool
+import os
+import re
+from app.core.cache import user_cache
+from app.core.config import settings
+from sqlalchemy.orm import Session
+from app.core.database import get_db
+from app.core.deps import get_current_user
+from app.core.images import AVATAR_FORMATS, InvalidImage, avatar_path, avatar_urls, image_processor
+from app.models.user import User
+
+router = APIRouter(prefix="/api/avatars", tags=["avatars"])
+
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+VARIANT_RE = re.compile(r"^(\d+)\.(webp|jpg)$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+def _set_user_avatar(db: Session, user_id: int, digest: str):
+    db.query(User).filter(User.id == user_id).update({User.avatar: digest})
+    db.commit()
+
+@router.post("/")
+async def upload_avatar(
+    file: UploadFile = File(...),
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    data = await file.read(settings.AVATAR_MAX_BYTES + 1)
+    if len(data) > settings.AVATAR_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Avatar too large")
+    try:
+        digest = await image_processor.store_avatar(data)
+    except InvalidImage:
+        raise HTTPException(status_code=400, detail="Unsupported or corrupt image")
+    await run_in_threadpool(_set_user_avatar, db, current_user["id"], digest)
+    user_cache.invalidate(current_user["id"])
+    return {"avatar": digest, "variants": avatar_urls(digest)}
+
+@router.get("/{digest}/{variant}")
+def get_avatar(digest: str, variant: str, request: Request):
+    match = VARIANT_RE.match(variant)
+    if not DIGEST_RE.match(digest) or not match:
+        raise HTTPException(status_code=404, detail="Avatar not found")
+    # Content-addressed, so the name is a strong validator for the bytes.
+    etag = f'"{digest[:16]}-{variant}"'
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": IMMUTABLE})
+    path = avatar_path(digest, variant)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Avatar not found")
+    return FileResponse(
+        path,
+        media_type=AVATAR_FORMATS[match.group(2)][1],
+        headers={"ETag": etag, "Cache-Control": IMMUTABLE, "Accept-Ranges": "bytes"},
+    )
@@ -1,52 +1,193 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, union, and_
 from sqlalchemy.orm import Session
-from typing import List
-from app.schemas.message import MessageCreate, MessageRead
+from typing import List, Optional
+from datetime import datetime, timezone
+from app.schemas.message import MessageCreate, MessageImport, MessageRead, ReadMark, ReadState, UnreadCounts
 from app.models.message import Message
 from app.models.user import User
-from app.core.database import SessionLocal
+from app.core import archive
+from app.core.database import get_db
+from app.core.deps import get_current_user, limit_per_user
+from app.core.export import EXPORT_FORMATS, export_stream
+from app.core.ids import message_ids
+from app.core.message_queue import message_writer, insert_messages
+from app.core.ratelimit import message_sends
+from app.core.serialize import json_response, dumps
+from app.core.unread import dm_conversation, ticket_conversation, mark_read, unread_counts
 
 router = APIRouter(prefix="/api/messages", tags=["messages"])
 
-@router.post("/", response_model=MessageRead)
-def send_message(message_in: MessageCreate):
-    db = SessionLocal()
-    db_message = Message(
-        sender_id=message_in.sender_id if hasattr(message_in, 'sender_id') else 1,  # Replace with actual user logic
-        receiver_id=message_in.receiver_id,
-        ticket_id=message_in.ticket_id,
-        content=message_in.content
+MAX_BATCH_SIZE = 5000
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def _cursor_filters(before_id: Optional[int], after_id: Optional[int]):
+    filters = []
+    if before_id is not None:
+        filters.append(Message.id < before_id)
+    if after_id is not None:
+        filters.append(Message.id > after_id)
+    return filters
+
+def _page_order(after_id: Optional[int]):
+    # Without after_id we page backwards from the newest message. Ids are
+    # allocated before the write-behind commit, so an after_id poll can miss
+    # a message that commits after a higher id; use the delivery log's seq
+    # to follow new messages (see app.core.ids).
+    return Message.id.asc() if after_id is not None else Message.id.desc()
+
+def _user_branches(user_id: int, with_user_id: Optional[int]):
+    if with_user_id is None:
+        return [Message.sender_id == user_id, Message.receiver_id == user_id]
+    return [
+        and_(Message.sender_id == user_id, Message.receiver_id == with_user_id),
+        and_(Message.sender_id == with_user_id, Message.receiver_id == user_id),
+    ]
+
+def _export_response(stmt, name: str, fmt: str, gzip: bool, archived) -> StreamingResponse:
+    filename = f"{name}.{fmt}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        export_stream(stmt, fmt, gzip, archived),
+        media_type="application/gzip" if gzip else EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
-    db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
-    db.close()
-    return MessageRead.from_orm(db_message)
+
+EXPORT_COLUMNS = [
+    Message.id, Message.sender_id, Message.receiver_id, Message.ticket_id,
+    Message.content, Message.timestamp, Message.read,
+]
+
+# History pages are read as plain rows in MessageRead's field order and
+# rendered directly (see app.core.serialize), not hydrated per message.
+READ_FIELDS = tuple(MessageRead.__fields__)
+READ_COLUMNS = [getattr(Message, field) for field in READ_FIELDS]
+
+def _ascending(messages: List[dict], after_id: Optional[int]) -> List[dict]:
+    return messages if after_id is not None else messages[::-1]
+
+def _history_response(db: Session, scope: archive.Scope, rows, before_id: Optional[int],
+                      after_id: Optional[int], limit: int):
+    # Fills the page from the cold tier where the hot table runs out or
+    # interleaves with archived segments.
+    page = [dict(zip(READ_FIELDS, row)) for row in rows]
+    page = archive.merge_page(db, scope, page, before_id, after_id, limit,
+                              lambda row: {field: row[field] for field in READ_FIELDS})
+    return json_response(dumps(_ascending(page, after_id)))
+
+@router.post("/", response_model=MessageRead, dependencies=[Depends(limit_per_user(message_sends))])
+def send_message(message_in: MessageCreate, current_user: dict = Depends(get_current_user)):
+    row = {
+        "id": message_ids.allocate()[0],
+        "sender_id": current_user["id"],
+        "receiver_id": message_in.receiver_id,
+        "ticket_id": message_in.ticket_id,
+        "content": message_in.content,
+        "timestamp": datetime.now(timezone.utc),
+        "read": False,
+    }
+    insert_messages([row])
+    return MessageRead(**row)
+
+@router.post("/batch")
+def send_message_batch(messages_in: List[MessageImport], current_user: dict = Depends(get_current_user)):
+    if len(messages_in) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_SIZE} messages per batch")
+    if not messages_in:
+        return {"count": 0, "ids": []}
+    now = datetime.now(timezone.utc)
+    ids = message_ids.allocate(len(messages_in))
+    # Imported messages are always sent as the caller, and are ordered by
+    # when they were imported (their new ids), whatever their timestamps.
+    rows = [
+        dict(m.dict(), id=message_id, sender_id=current_user["id"], timestamp=m.timestamp or now)
+        for message_id, m in zip(ids, messages_in)
+    ]
+    insert_messages(rows)
+    return {"count": len(rows), "ids": ids}
 
 @router.get("/ticket/{ticket_id}", response_model=List[MessageRead])
-def list_ticket_messages(ticket_id: int):
-    db = SessionLocal()
-    messages = db.query(Message).filter(Message.ticket_id == ticket_id).order_by(Message.timestamp).all()
-    db.close()
-    return [MessageRead.from_orm(m) for m in messages]
+def list_ticket_messages(
+    ticket_id: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+):
+    rows = db.execute(select(*READ_COLUMNS).where(
+        Message.ticket_id == ticket_id, *_cursor_filters(before_id, after_id)
+    ).order_by(_page_order(after_id)).limit(limit)).all()
+    return _history_response(db, archive.ticket_scope(ticket_id), rows, before_id, after_id, limit)
 
 @router.get("/user/{user_id}", response_model=List[MessageRead])
-def list_user_messages(user_id: int):
-    db = SessionLocal()
-    messages = db.query(Message).filter(
-        ((Message.sender_id == user_id) | (Message.receiver_id == user_id))
-    ).order_by(Message.timestamp).all()
-    db.close()
-    return [MessageRead.from_orm(m) for m in messages]
+def list_user_messages(
+    user_id: int,
+    with_user_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+):
+    branches = _user_branches(user_id, with_user_id)
+    # One index range scan per branch, each already limited, instead of an
+    # OR over two columns that no single index can serve.
+    cursor = _cursor_filters(before_id, after_id)
+    order = _page_order(after_id)
+    selects = [
+        select(Message.id).where(branch, *cursor).order_by(order).limit(limit).subquery()
+        for branch in branches
+    ]
+    ids = union(*[select(sq.c.id) for sq in selects]).subquery()
+    rows = db.execute(select(*READ_COLUMNS).where(
+        Message.id.in_(select(ids.c.id))
+    ).order_by(order).limit(limit)).all()
+    return _history_response(db, archive.user_scope(user_id, with_user_id), rows, before_id, after_id, limit)
+
+@router.get("/ticket/{ticket_id}/export")
+def export_ticket_messages(
+    ticket_id: int,
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    gzip: bool = False,
+):
+    stmt = select(*EXPORT_COLUMNS).where(Message.ticket_id == ticket_id).order_by(Message.id)
+    archived = archive.iter_rows(archive.ticket_scope(ticket_id))
+    return _export_response(stmt, f"ticket_{ticket_id}_messages", format, gzip, archived)
+
+@router.get("/user/{user_id}/export")
+def export_user_messages(
+    user_id: int,
+    with_user_id: Optional[int] = None,
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    gzip: bool = False,
+):
+    ids = union(*[select(Message.id).where(branch) for branch in _user_branches(user_id, with_user_id)]).subquery()
+    stmt = select(*EXPORT_COLUMNS).where(Message.id.in_(select(ids.c.id))).order_by(Message.id)
+    name = f"user_{user_id}_messages" if with_user_id is None else f"user_{user_id}_{with_user_id}_messages"
+    return _export_response(stmt, name, format, gzip, archive.iter_rows(archive.user_scope(user_id, with_user_id)))
 
 @router.post("/{message_id}/read")
-def mark_message_read(message_id: int):
-    db = SessionLocal()
+def mark_message_read(message_id: int, db: Session = Depends(get_db)):
     message = db.query(Message).filter(Message.id == message_id).first()
     if not message:
-        db.close()
         raise HTTPException(status_code=404, detail="Message not found")
     message.read = True
     db.commit()
-    db.close()
-    return {"detail": "Message marked as read"} 
\ No newline at end of file
+    return {"detail": "Message marked as read"} 
+
+@router.post("/read", response_model=ReadState)
+def mark_conversation_read(mark: ReadMark, current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+    if (mark.peer_id is None) == (mark.ticket_id is None):
+        raise HTTPException(status_code=422, detail="Provide exactly one of peer_id or ticket_id")
+    conversation = dm_conversation(mark.peer_id) if mark.peer_id is not None else ticket_conversation(mark.ticket_id)
+    watermark = mark_read(db, current_user["id"], conversation, mark.up_to_id)
+    return ReadState(conversation=conversation, last_read_id=watermark.last_read_id, unread_count=watermark.unread_count)
+
+@router.get("/unread", response_model=UnreadCounts)
+def get_unread_counts(current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+    total, conversations = unread_counts(db, current_user["id"])
+    return UnreadCounts(total=total, conversations=conversations)
+
+@router.get("/queue/stats")
+def message_queue_stats():
+    return message_writer.stats()
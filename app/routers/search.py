@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Depends, Query
+from app.core.deps import get_current_user
+from app.core.search import search_index
+
+router = APIRouter(prefix="/api/search", tags=["search"])
+
+@router.get("/")
+def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    type: str = Query("all", regex="^(all|messages|tickets)$"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    current_user: dict = Depends(get_current_user),
+):
+    # Customers only see their own conversations and tickets; staff see all.
+    scope = current_user["id"] if current_user.get("role") == "user" else None
+    results = {}
+    if type in ("all", "messages"):
+        results["messages"] = search_index.search_messages(q, limit, offset, scope)
+    if type in ("all", "tickets"):
+        results["tickets"] = search_index.search_tickets(q, limit, offset, scope)
+    return results
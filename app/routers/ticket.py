@@ -1,9 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import and_, or_, func, select
 from sqlalchemy.orm import Session
-from typing import List
-from app.models.ticket import Ticket
+from typing import List, Optional
+from datetime import datetime
+import base64
+import json
+from app.models.ticket import Ticket, TicketStatus, TicketPriority, TicketLog
+from app.schemas.ticket import TicketUpdate
 from app.models.user import User
-from app.core.database import SessionLocal
+from app.core.database import get_db
+from app.core.cache import ticket_cache
+from app.core.deps import get_current_user, limit_per_user
+from app.core.ratelimit import ticket_creates
+from app.core.search import search_index
+from app.core.serialize import rows_response
+from app.core.ticket_stats import apply_ticket_created, apply_ticket_change, queue_key, queue_counts, sla_summary
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/api/tickets", tags=["tickets"])
@@ -26,34 +37,138 @@ class TicketRead(BaseModel):
     class Config:
         orm_mode = True
 
+# Only the columns TicketRead needs, in its field order, plus created_at for
+# the cursor. Rows are rendered directly (see app.core.serialize).
+TICKET_READ_FIELDS = tuple(TicketRead.__fields__)
+TICKET_LIST_COLUMNS = tuple(getattr(Ticket, field) for field in TICKET_READ_FIELDS) + (Ticket.created_at,)
+
+def encode_cursor(created_at: datetime, ticket_id: int) -> str:
+    raw = json.dumps([created_at.isoformat() if created_at else None, ticket_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, ticket_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (datetime.fromisoformat(created_at) if created_at else None), int(ticket_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @router.get("/", response_model=List[TicketRead])
-def list_tickets():
-    db = SessionLocal()
-    tickets = db.query(Ticket).all()
-    db.close()
-    return tickets
-
-@router.post("/", response_model=TicketRead)
-def create_ticket(ticket_in: TicketCreate):
-    db = SessionLocal()
+def list_tickets(
+    status: Optional[List[TicketStatus]] = Query(None),
+    priority: Optional[List[TicketPriority]] = Query(None),
+    assignee_id: Optional[int] = None,
+    creator_id: Optional[int] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+):
+    # Newest first, keyset-paginated on (created_at, id). The cursor for the
+    # next page is returned in the X-Next-Cursor header.
+    filters = []
+    if status:
+        filters.append(Ticket.status.in_(status))
+    if priority:
+        filters.append(Ticket.priority.in_(priority))
+    if assignee_id is not None:
+        filters.append(Ticket.assignee_id == assignee_id)
+    if creator_id is not None:
+        filters.append(Ticket.creator_id == creator_id)
+    if created_after is not None:
+        filters.append(Ticket.created_at >= created_after)
+    if created_before is not None:
+        filters.append(Ticket.created_at < created_before)
+    if cursor:
+        cursor_created_at, cursor_id = decode_cursor(cursor)
+        if cursor_created_at is None:
+            filters.append(and_(Ticket.created_at.is_(None), Ticket.id < cursor_id))
+        else:
+            filters.append(or_(
+                Ticket.created_at < cursor_created_at,
+                and_(Ticket.created_at == cursor_created_at, Ticket.id < cursor_id),
+            ))
+    tickets = db.execute(select(*TICKET_LIST_COLUMNS).where(*filters).order_by(
+        Ticket.created_at.desc(), Ticket.id.desc()
+    ).limit(limit)).all()
+    headers = {}
+    if len(tickets) == limit:
+        last = tickets[-1]
+        headers["X-Next-Cursor"] = encode_cursor(last.created_at, last.id)
+    return rows_response(TICKET_READ_FIELDS, tickets, headers)
+
+@router.post("/", response_model=TicketRead, dependencies=[Depends(limit_per_user(ticket_creates))])
+def create_ticket(ticket_in: TicketCreate, current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
     ticket = Ticket(
         title=ticket_in.title,
         description=ticket_in.description,
         priority=ticket_in.priority,
-        creator_id=1,  # Replace with actual user ID from auth if needed
+        creator_id=current_user["id"],
         assignee_id=ticket_in.assignee_id
     )
     db.add(ticket)
+    db.flush()
+    apply_ticket_created(db, ticket)
     db.commit()
     db.refresh(ticket)
-    db.close()
+    search_index.index_ticket(ticket.id, ticket.title, ticket.description, ticket.creator_id)
     return ticket
 
+@router.patch("/{ticket_id}", response_model=TicketRead)
+def update_ticket(
+    ticket_id: int,
+    ticket_in: TicketUpdate,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    changes = ticket_in.dict(exclude_unset=True)
+    try:
+        if changes.get("status") is not None:
+            changes["status"] = TicketStatus(changes["status"])
+        if changes.get("priority") is not None:
+            changes["priority"] = TicketPriority(changes["priority"])
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    ticket = db.query(Ticket).filter(Ticket.id == ticket_id).with_for_update().first()
+    if not ticket:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    before = queue_key(ticket)
+    old_status = ticket.status
+    for field, value in changes.items():
+        if value is not None or field == "assignee_id":
+            setattr(ticket, field, value)
+    if ticket.status != old_status:
+        db.add(TicketLog(
+            ticket_id=ticket.id,
+            status_from=old_status.value,
+            status_to=ticket.status.value,
+            changed_by=current_user["id"],
+        ))
+        if ticket.status == TicketStatus.CLOSED:
+            ticket.closed_at = func.now()
+        elif old_status == TicketStatus.CLOSED:
+            ticket.closed_at = None
+    db.flush()
+    db.refresh(ticket)
+    apply_ticket_change(db, before, ticket)
+    db.commit()
+    db.refresh(ticket)
+    ticket_cache.invalidate(ticket.id)
+    search_index.index_ticket(ticket.id, ticket.title, ticket.description, ticket.creator_id)
+    return ticket
+
+@router.get("/stats/queue")
+def ticket_queue_stats(db: Session = Depends(get_db)):
+    return queue_counts(db)
+
+@router.get("/stats/sla")
+def ticket_sla_stats(db: Session = Depends(get_db)):
+    return sla_summary(db)
+
 @router.get("/{ticket_id}", response_model=TicketRead)
-def get_ticket(ticket_id: int):
-    db = SessionLocal()
+def get_ticket(ticket_id: int, db: Session = Depends(get_db)):
     ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
-    db.close()
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
     return ticket 
\ No newline at end of file
@@ -1,22 +1,97 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query
-from typing import Dict, List
+import asyncio
+from typing import List, Optional
+from app.core.broker import broker
+from app.core.cache import aget_user_display, aget_ticket_routing
+from app.core.connections import Connection, registry, stats as connection_stats
+from app.core.delivery import delivery_log, replay
+from app.core.message_queue import message_writer
+from app.core.metrics import Counter, Gauge, Histogram
+from app.core.presence import presence, dm_typing_key, ticket_typing_key, status_of
+from app.core.ratelimit import RateLimiter, admission, rate_limit_stats, ticket_frames, ws_connects, ws_frames
+from app.core import protocol as wire
 from app.core.security import decode_access_token
-from app.core.database import SessionLocal
-from app.models.user import User
-from app.models.ticket import Ticket
-from app.models.message import Message
-from sqlalchemy.orm import Session
-import json
+from app.core.signaling import signaling
+import time
+import uuid
 
 router = APIRouter()
 
-active_connections: Dict[int, List[WebSocket]] = {}
+# Sockets held by this worker only live in app.core.connections.registry.
+# Delivery between workers goes through the broker: each of the registry's
+# channels is a broker channel this worker is subscribed to.
 
-# In-memory call state
-user_call_state = {}  # user_id: {'state': 'idle'|'ringing'|'in_call', 'peer': int}
-ticket_call_state = {}  # ticket_id: {'state': 'idle'|'ringing'|'in_call', 'users': set}
+# Shared state lives in the broker so every worker sees the same view:
+#   ticket_users: ticket_id -> set of user ids in the ticket room
+#   ticket_sockets: "ticket_id:user_id" -> open sockets of the user in the room
+#   presence:    user_id   -> number of open chat sockets across workers
+#   (presence_status and typing are owned by app.core.presence; user_call,
+#   ticket_call and calls by app.core.signaling)
+# The relay takes a worker's share of this back out when the worker goes
+# away, see app.core.broker.Contributions.
 
-signal_connections = {}  # user_id: websocket
+def _connections_by_kind():
+    counts = {}
+    for channel, conns in registry.channels.items():
+        kind = (channel.split(":", 1)[0],)
+        counts[kind] = counts.get(kind, 0) + len(conns)
+    return counts
+
+frames_received = Counter("ws_frames_received_total", "Frames received from WebSocket clients.", ("endpoint",))
+frame_duration = Histogram("ws_frame_handling_seconds", "Time from receiving a chat frame to publishing it.", ("endpoint",))
+Gauge("ws_channel_connections", "Local sockets per channel kind.", ("kind",), callback=_connections_by_kind)
+Gauge("ws_channels", "Broker channels this worker is subscribed to for sockets.", callback=lambda: {(): len(registry.channels)})
+
+def user_channel(user_id: int) -> str:
+    return f"user:{user_id}"
+
+def ticket_channel(ticket_id: int) -> str:
+    return f"ticket:{ticket_id}"
+
+def signal_channel(user_id: int) -> str:
+    return f"signal:{user_id}"
+
+async def deliver_local(channel: str, event: dict):
+    # Encodes the event once per protocol and only queues the frame on each
+    # connection; writer tasks do the sending.
+    if channel.startswith("signal:"):
+        # Signaling payloads are envelopes naming the device(s) to reach;
+        # no device means every device of the user.
+        to_device, except_device = event.get("device"), event.get("except_device")
+        targets = [
+            conn for conn in registry.members(channel)
+            if (to_device is None or conn.device == to_device) and conn.device != except_device
+        ]
+        event = event["event"]
+    else:
+        targets = registry.members(channel)
+    encoded = wire.EncodedEvent(event)
+    for conn in targets:
+        frame = encoded.for_protocol(conn.protocol)
+        if frame is not None:
+            conn.send(frame)
+
+broker.set_handler(deliver_local)
+
+async def admit(websocket: WebSocket) -> Optional[wire.Protocol]:
+    # Per-IP connect limit, then this worker's admission gate. Refused
+    # handshakes are still accepted so the client sees a 1013 close (try
+    # again later) rather than a bare HTTP 403; None tells the caller to stop.
+    host = websocket.client.host if websocket.client else None
+    refused = ws_connects.check(host) or not await admission.admit()
+    protocol = await wire.accept(websocket)
+    if refused:
+        await websocket.close(code=1013)
+        return None
+    return protocol
+
+def throttled(conn: Connection, limiter: RateLimiter, key) -> bool:
+    # Frames over the limit are dropped before they cost a DB write or a
+    # broadcast; structured clients are told when to try again.
+    wait = limiter.check(key)
+    if wait and conn.protocol is not wire.LEGACY:
+        conn.send(conn.protocol.encode(wire.event("error", reason="rate_limited", retry_after=round(wait, 3))))
+    return bool(wait)
 
 def get_user_id_from_token(token: str) -> int:
     payload = decode_access_token(token)
@@ -24,58 +99,128 @@ def get_user_id_from_token(token: str) -> int:
         return None
     return int(payload["sub"])
 
-async def connect_user(user_id: int, websocket: WebSocket):
-    if user_id not in active_connections:
-        active_connections[user_id] = []
-    active_connections[user_id].append(websocket)
-
-async def disconnect_user(user_id: int, websocket: WebSocket):
-    if user_id in active_connections:
-        active_connections[user_id].remove(websocket)
-        if not active_connections[user_id]:
-            del active_connections[user_id]
-
-async def send_notification_to_user(user_id: int, payload: str):
-    if user_id in active_connections:
-        for ws in active_connections[user_id]:
-            try:
-                await ws.send_text(payload)
-            except Exception:
-                pass
+def open_connection(websocket: WebSocket, protocol: wire.Protocol, user_id: int,
+                    device: Optional[str] = None) -> Connection:
+    conn = Connection(websocket, protocol, user_id=user_id, device=device)
+    registry.add(conn)
+    return conn
+
+async def close_connection(conn: Connection):
+    # Leaves every channel the socket was in, then closes it.
+    for channel in registry.remove(conn):
+        await broker.unsubscribe(channel)
+    await conn.close(1001 if conn.reaped else 1000)
+
+async def join_channel(channel: str, conn: Connection):
+    if registry.join(channel, conn):
+        await broker.subscribe(channel)
+
+async def leave_channel(channel: str, conn: Connection):
+    if registry.leave(channel, conn):
+        await broker.unsubscribe(channel)
+
+async def connect_user(user_id: int, conn: Connection):
+    await join_channel(user_channel(user_id), conn)
+    broker.incr("presence", user_id)
+    presence.user_changed(user_id)
+
+async def disconnect_user(user_id: int, conn: Connection):
+    await leave_channel(user_channel(user_id), conn)
+    if broker.incr("presence", user_id, -1) <= 0:
+        broker.delete("presence_status", user_id)
+    presence.user_changed(user_id)
+
+def room_join(ticket_id: int, user_id: int):
+    # Every worker with a socket of the user in the room holds the member,
+    # so the relay keeps it while any of them is alive.
+    broker.incr("ticket_sockets", f"{ticket_id}:{user_id}")
+    broker.sadd("ticket_users", ticket_id, user_id)
+
+def room_leave(ticket_id: int, user_id: int) -> bool:
+    # True if this was the user's last socket in the room on this worker.
+    if broker.incr("ticket_sockets", f"{ticket_id}:{user_id}", -1) <= 0:
+        broker.srem("ticket_users", ticket_id, user_id)
+    elif not any(other.user_id == user_id for other in registry.members(ticket_channel(ticket_id))):
+        broker.release("ticket_users", ticket_id, user_id)
+    else:
+        return False
+    return True
+
+async def send_notification_to_user(user_id: int, event: dict):
+    # Logged in the user's delivery log first (which numbers it), then
+    # published, so offline users can pick it up when they reconnect.
+    await delivery_log.deliver(user_id, event)
+
+async def publish_to_user(user_id: int, event: dict):
+    await broker.publish(user_channel(user_id), event)
+
+delivery_log.set_handler(publish_to_user)
+
+async def publish_to_ticket(ticket_id: int, event: dict):
+    await broker.publish(ticket_channel(ticket_id), event)
+
+presence.set_publishers(publish_to_user, publish_to_ticket)
+
+async def publish_signal(user_id: int, event: dict, device: Optional[str] = None, except_device: Optional[str] = None):
+    await broker.publish(signal_channel(user_id), {"event": event, "device": device, "except_device": except_device})
+
+signaling.set_publisher(publish_signal)
 
 @router.websocket("/ws/chat/{other_user_id}")
-async def websocket_user_chat(websocket: WebSocket, other_user_id: int, token: str = Query(...)):
+async def websocket_user_chat(
+    websocket: WebSocket, other_user_id: int, token: str = Query(...), since: Optional[int] = Query(None, ge=0)
+):
     user_id = get_user_id_from_token(token)
     if not user_id:
         await websocket.close(code=1008)
         return
-    await websocket.accept()
-    await connect_user(user_id, websocket)
-    db: Session = SessionLocal()
+    protocol = await admit(websocket)
+    if protocol is None:
+        return
+    conn = open_connection(websocket, protocol, user_id)
+    typing_key = dm_typing_key(user_id, other_user_id)
+    await connect_user(user_id, conn)
+    # Subscribed before replaying, so nothing published in between is lost.
+    # Legacy frames carry no seq, so only structured clients can resume.
+    resync = None
+    if since is not None and protocol is not wire.LEGACY:
+        resync = asyncio.create_task(replay(conn, user_id, since))
     try:
         while True:
-            data = await websocket.receive_text()
-            try:
-                msg = json.loads(data)
-            except Exception:
-                msg = None
-            if msg is not None:
+            incoming = await conn.receive()
+            frames_received.inc(1, "chat")
+            kind = incoming.get("type") if incoming else None
+            if kind == "typing":
+                presence.set_typing(typing_key, user_id, bool(incoming.get("active")))
+                continue
+            if kind == "presence":
+                presence.set_away(user_id, incoming.get("status") == "away")
+                continue
+            if kind != "message" or not isinstance(incoming.get("content"), str):
+                continue
+            if throttled(conn, ws_frames, user_id):
                 continue
-            db_message = Message(
-                sender_id=user_id,
-                receiver_id=other_user_id,
-                content=data
-            )
-            db.add(db_message)
-            db.commit()
-            db.refresh(db_message)
-            if other_user_id in active_connections:
-                for ws in active_connections[other_user_id]:
-                    await ws.send_text(f"{user_id}: {data}")
+            data = incoming["content"]
+            presence.set_typing(typing_key, user_id, False)
+            started = time.perf_counter()
+            row = await message_writer.enqueue({
+                "sender_id": user_id,
+                "receiver_id": other_user_id,
+                "content": data,
+            })
+            await send_notification_to_user(other_user_id, wire.event(
+                "chat", id=row["id"], sender_id=user_id, receiver_id=other_user_id,
+                content=data, ts=row["timestamp"].isoformat(),
+            ))
+            frame_duration.observe(time.perf_counter() - started, "chat")
     except WebSocketDisconnect:
-        await disconnect_user(user_id, websocket)
+        pass
     finally:
-        db.close()
+        if resync is not None:
+            resync.cancel()
+        presence.set_typing(typing_key, user_id, False)
+        await disconnect_user(user_id, conn)
+        await close_connection(conn)
 
 @router.websocket("/ws/ticket/{ticket_id}")
 async def websocket_ticket_chat(websocket: WebSocket, ticket_id: int, token: str = Query(...)):
@@ -83,74 +228,100 @@ async def websocket_ticket_chat(websocket: WebSocket, ticket_id: int, token: str
     if not user_id:
         await websocket.close(code=1008)
         return
-    await websocket.accept()
-    group = f"ticket_{ticket_id}"
-    if group not in active_connections:
-        active_connections[group] = []
-    active_connections[group].append(websocket)
-    # --- Robust ticket call state ---
-    if ticket_id not in ticket_call_state:
-        ticket_call_state[ticket_id] = {'state': 'idle', 'users': set()}
-    ticket_call_state[ticket_id]['users'].add(user_id)
-    db: Session = SessionLocal()
+    protocol = await admit(websocket)
+    if protocol is None:
+        return
+    conn = open_connection(websocket, protocol, user_id)
+    group = ticket_channel(ticket_id)
+    await join_channel(group, conn)
+    room_join(ticket_id, user_id)
+    presence.room_joined(ticket_id, user_id)
+    typing_key = ticket_typing_key(ticket_id)
     try:
         while True:
-            data = await websocket.receive_text()
-            try:
-                msg = json.loads(data)
-            except Exception:
-                msg = None
-            if msg is not None:
+            incoming = await conn.receive()
+            frames_received.inc(1, "ticket")
+            kind = incoming.get("type") if incoming else None
+            if kind == "typing":
+                presence.set_typing(typing_key, user_id, bool(incoming.get("active")))
+                continue
+            if kind != "message" or not isinstance(incoming.get("content"), str):
+                continue
+            if throttled(conn, ws_frames, user_id):
                 continue
-            # Save message to DB
-            db_message = Message(
-                sender_id=user_id,
-                ticket_id=ticket_id,
-                content=data
-            )
-            db.add(db_message)
-            db.commit()
-            db.refresh(db_message)
-            sender = db.query(User).filter(User.id == user_id).first()
-            ticket = db.query(Ticket).filter(Ticket.id == ticket_id).first()
-            timestamp = db_message.timestamp.strftime('%I:%M %p') if hasattr(db_message, 'timestamp') and db_message.timestamp else ""
-            for ws in list(active_connections[group]):
-                await ws.send_text(f"{user_id}:{data}|{timestamp}|{sender.name if sender else ''}")
+            if throttled(conn, ticket_frames, ticket_id):
+                ws_frames.refund(user_id)
+                continue
+            data = incoming["content"]
+            presence.set_typing(typing_key, user_id, False)
+            started = time.perf_counter()
+            # Save message to DB (write-behind)
+            row = await message_writer.enqueue({
+                "sender_id": user_id,
+                "ticket_id": ticket_id,
+                "content": data,
+            })
+            sender = await aget_user_display(user_id)
+            ticket = await aget_ticket_routing(ticket_id)
+            await broker.publish(group, wire.event(
+                "ticket_message", id=row["id"], ticket_id=ticket_id, sender_id=user_id,
+                sender_name=sender["name"] if sender else None, content=data, ts=row["timestamp"].isoformat(),
+            ))
             if ticket:
-                for notify_id in set([ticket.creator_id, ticket.assignee_id]):
+                in_room = broker.smembers("ticket_users", ticket_id)
+                for notify_id in set([ticket["creator_id"], ticket["assignee_id"]]):
                     if notify_id and notify_id != user_id:
-                        if notify_id not in active_connections.get(group, []):
-                            payload = f"NOTIFY:ticket:{ticket_id}:{ticket.title}:{data[:30]}"
-                            await send_notification_to_user(notify_id, payload)
+                        if notify_id not in in_room:
+                            await send_notification_to_user(notify_id, wire.event(
+                                "notify", ticket_id=ticket_id, title=ticket["title"], preview=data[:30],
+                            ))
+            frame_duration.observe(time.perf_counter() - started, "ticket")
     except WebSocketDisconnect:
-        active_connections[group].remove(websocket)
-        if not active_connections[group]:
-            del active_connections[group]
-        # Remove user from ticket call state
-        if ticket_id in ticket_call_state:
-            ticket_call_state[ticket_id]['users'].discard(user_id)
-            if not ticket_call_state[ticket_id]['users']:
-                del ticket_call_state[ticket_id]
-            else:
-                ticket_call_state[ticket_id]['state'] = 'idle'
+        pass
     finally:
-        db.close()
+        await close_connection(conn)
+        if room_leave(ticket_id, user_id):
+            presence.room_left(ticket_id, user_id)
 
 @router.websocket("/ws/signal/{peer_id}")
-async def websocket_signal(websocket: WebSocket, peer_id: int, token: str = Query(...)):
+async def websocket_signal(
+    websocket: WebSocket, peer_id: int, token: str = Query(...), device: Optional[str] = Query(None, max_length=64)
+):
+    # One socket per device; a user may have several open at once. Structured
+    # clients drive the call state machine in app.core.signaling ("call",
+    # "signal" and "ice" events); legacy clients just relay raw SDP/ICE text
+    # to every device of the peer.
     user_id = get_user_id_from_token(token)
     if not user_id:
         await websocket.close(code=1008)
         return
-    await websocket.accept()
-    signal_connections[user_id] = websocket
+    protocol = await admit(websocket)
+    if protocol is None:
+        return
+    conn = open_connection(websocket, protocol, user_id, device or uuid.uuid4().hex[:16])
+    await join_channel(signal_channel(user_id), conn)
     try:
         while True:
-            data = await websocket.receive_text()
-            # Relay to peer if connected
-            peer_ws = signal_connections.get(peer_id)
-            if peer_ws:
-                await peer_ws.send_text(data)
+            incoming = await conn.receive()
+            frames_received.inc(1, "signal")
+            if not incoming or throttled(conn, ws_frames, user_id):
+                continue
+            if protocol is wire.LEGACY:
+                data = incoming.get("content", incoming.get("raw"))
+                await publish_signal(peer_id, wire.event("signal", sender_id=user_id, data=data))
+            elif incoming.get("type") in ("call", "signal", "ice"):
+                await signaling.handle(user_id, conn.device, peer_id, incoming)
     except WebSocketDisconnect:
-        if user_id in signal_connections:
-            del signal_connections[user_id] 
\ No newline at end of file
+        pass
+    finally:
+        await close_connection(conn)
+        if not any(other.device == conn.device for other in registry.members(signal_channel(user_id))):
+            await signaling.device_gone(user_id, conn.device)
+
+@router.get("/api/ws/stats")
+def websocket_stats():
+    return dict(connection_stats.as_dict(), **registry.stats(), presence=presence.stats(), rate_limits=rate_limit_stats())
+
+@router.get("/api/presence/")
+def get_presence(user_ids: List[int] = Query(..., max_items=200)):
+    return {user_id: status_of(user_id) for user_id in user_ids} 
\ No newline at end of file
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, Optional
 from datetime import datetime
 
 class MessageBase(BaseModel):
@@ -10,6 +10,13 @@ class MessageBase(BaseModel):
 class MessageCreate(MessageBase):
     pass
 
+class MessageImport(MessageBase):
+    # Kept as given, but imported messages still get new ids: history and
+    # exports are ordered by id (ingestion), so an old transcript shows up
+    # after what was already there, not at its timestamp.
+    timestamp: Optional[datetime] = None
+    read: bool = False
+
 class MessageRead(MessageBase):
     id: int
     sender_id: int
@@ -17,4 +24,18 @@ class MessageRead(MessageBase):
     read: bool
 
     class Config:
-        orm_mode = True 
\ No newline at end of file
+        orm_mode = True 
+
+class ReadMark(BaseModel):
+    peer_id: Optional[int] = None
+    ticket_id: Optional[int] = None
+    up_to_id: int
+
+class ReadState(BaseModel):
+    conversation: str
+    last_read_id: int
+    unread_count: int
+
+class UnreadCounts(BaseModel):
+    total: int
+    conversations: Dict[str, int]
@@ -0,0 +1,364 @@
+"""Load and latency benchmarks for the REST and WebSocket paths.
+
+Boots app.main:app under uvicorn against a throwaway database (SQLite by
+default, or whatever --database-url points at, e.g. a MySQL container),
+seeds users/tickets/history directly, then runs the scenarios and writes
+the results as JSON.
+
+    python -m bench.run --clients 2000 --output bench_results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+import websockets
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MARKER = "bench:"
+
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(fraction):
+        return round(ordered[min(int(fraction * len(ordered)), len(ordered) - 1)] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def rss_bytes(pid):
+    # Resident memory of the server and all of its worker processes.
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parent = int(f.read().rsplit(")", 1)[1].split()[1])
+                children.setdefault(parent, []).append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        stack.extend(children.get(current, ()))
+    return total
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def seed(env, args):
+    # Seeding goes straight to the database: hashing thousands of bcrypt
+    # passwords through /register would dominate the run.
+    os.environ.update(env)
+    sys.path.insert(0, REPO_ROOT)
+    from sqlalchemy import insert
+    from app.core.database import Base, engine
+    from app.core.security import create_access_token, get_password_hash
+    from app.models import archive, delivery, id_block, message, read_state, stats, ticket, user  # noqa: F401
+
+    Base.metadata.create_all(engine)
+    password_hash = get_password_hash("bench-password")
+    users = [
+        {"id": i, "name": f"user{i}", "email": f"user{i}@bench.local", "role": "agent" if i % 10 == 0 else "user",
+         "password_hash": password_hash}
+        for i in range(1, args.users + 1)
+    ]
+    tickets = [
+        {"id": i, "title": f"ticket {i}", "description": "benchmark ticket", "status": "OPEN", "priority": "NORMAL",
+         "creator_id": random.randint(1, args.users), "assignee_id": random.randint(1, args.users)}
+        for i in range(1, args.tickets + 1)
+    ]
+    now = datetime.now(timezone.utc)
+    history = []
+    for i in range(1, args.history + 1):
+        row = {"id": i, "sender_id": random.randint(1, args.users), "content": f"history message {i}",
+               "timestamp": now, "read": False, "receiver_id": None, "ticket_id": None}
+        if i % 2:
+            row["ticket_id"] = random.randint(1, args.tickets)
+        else:
+            row["receiver_id"] = random.randint(1, args.users)
+        history.append(row)
+    with engine.begin() as conn:
+        conn.execute(insert(user.User), users)
+        conn.execute(insert(ticket.Ticket), tickets)
+        for start in range(0, len(history), 5000):
+            conn.execute(insert(message.Message), history[start:start + 5000])
+        conn.execute(insert(id_block.IdBlock), [{"name": "messages", "next_id": args.history + 1}])
+    engine.dispose()
+    return {u["id"]: create_access_token({"sub": str(u["id"])}) for u in users}
+
+
+def start_server(env, port, workers, workdir, deflate=True):
+    command = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(workers), "--log-level", "warning", "--ws-per-message-deflate", str(deflate).lower()]
+    server_env = dict(os.environ, **env, PYTHONPATH=REPO_ROOT)
+    return subprocess.Popen(command, cwd=workdir, env=server_env)
+
+
+async def wait_ready(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(base_url + "/")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+
+async def run_requests(make_request, concurrency, duration):
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await make_request()
+                if response.status_code >= 400:
+                    errors += 1
+                    continue
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return dict(percentiles(latencies), errors=errors, requests_per_sec=round(len(latencies) / elapsed, 1))
+
+
+async def bench_login(base_url, args):
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        def request():
+            user_id = random.randint(1, args.users)
+            return client.post("/api/auth/login", json={"email": f"user{user_id}@bench.local", "password": "bench-password"})
+        return await run_requests(request, args.concurrency, args.duration)
+
+
+async def bench_history(base_url, args, tokens):
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as client:
+        def request():
+            if random.random() < 0.5:
+                return client.get(f"/api/messages/ticket/{random.randint(1, args.tickets)}", params={"limit": 50})
+            return client.get(f"/api/messages/user/{random.randint(1, args.users)}", params={"limit": 50})
+        return await run_requests(request, args.concurrency, args.duration)
+
+
+async def bench_websockets(ws_url, args, tokens):
+    # Half the clients join ticket rooms, half open DMs. A subset sends
+    # timestamped frames; every receiver records delivery latency.
+    latencies, received, errors = [], 0, 0
+    connections = []
+    stop = asyncio.Event()
+
+    async def reader(ws):
+        nonlocal received
+        try:
+            async for frame in ws:
+                if isinstance(frame, bytes):
+                    frame = frame.decode(errors="ignore")
+                index = frame.find(MARKER)
+                if index >= 0 and not frame.startswith("NOTIFY:"):
+                    sent = float(frame[index + len(MARKER):].split("|", 1)[0].split()[0])
+                    latencies.append(time.perf_counter() - sent)
+                    received += 1
+        except websockets.ConnectionClosed:
+            pass
+
+    async def connect(i):
+        nonlocal errors
+        user_id = (i % args.users) + 1
+        if i % 2:
+            path = f"/ws/ticket/{(i % args.tickets) + 1}"
+        else:
+            path = f"/ws/chat/{((i + 1) % args.users) + 1}"
+        try:
+            ws = await websockets.connect(f"{ws_url}{path}?token={tokens[user_id]}", open_timeout=30, max_queue=None)
+        except Exception:
+            errors += 1
+            return
+        connections.append(ws)
+        asyncio.create_task(reader(ws))
+
+    connect_started = time.perf_counter()
+    for start in range(0, args.clients, 200):
+        await asyncio.gather(*(connect(i) for i in range(start, min(start + 200, args.clients))))
+    connect_seconds = time.perf_counter() - connect_started
+
+    senders = connections[: max(1, len(connections) * args.sender_ratio // 100)]
+    sent = 0
+
+    async def send_loop(ws):
+        nonlocal sent, errors
+        interval = 1.0 / args.rate
+        while not stop.is_set():
+            try:
+                await ws.send(f"{MARKER}{time.perf_counter()} load")
+                sent += 1
+            except websockets.ConnectionClosed:
+                errors += 1
+                return
+            await asyncio.sleep(interval)
+
+    send_started = time.perf_counter()
+    tasks = [asyncio.create_task(send_loop(ws)) for ws in senders]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    await asyncio.sleep(1)
+    elapsed = time.perf_counter() - send_started
+    await asyncio.gather(*(ws.close() for ws in connections), return_exceptions=True)
+    return dict(
+        percentiles(latencies),
+        clients=len(connections),
+        connect_errors=errors,
+        connect_seconds=round(connect_seconds, 3),
+        frames_sent=sent,
+        frames_received=received,
+        sent_per_sec=round(sent / elapsed, 1),
+        delivered_per_sec=round(received / elapsed, 1),
+    )
+
+
+async def bench_idle(ws_url, args, tokens, server_pid):
+    # Opens --idle-clients sockets that never send and reports the server's
+    # resident memory per connection. Run with a raised `ulimit -n`.
+    connections, errors = [], 0
+    before = rss_bytes(server_pid)
+
+    async def connect(i):
+        nonlocal errors
+        user_id = (i % args.users) + 1
+        path = f"/ws/ticket/{(i % args.tickets) + 1}" if i % 2 else f"/ws/chat/{((i + 1) % args.users) + 1}"
+        try:
+            connections.append(await websockets.connect(
+                f"{ws_url}{path}?token={tokens[user_id]}", open_timeout=60, subprotocols=["supportchat.v1.json"],
+            ))
+        except Exception:
+            errors += 1
+
+    connect_started = time.perf_counter()
+    for start in range(0, args.idle_clients, 500):
+        await asyncio.gather(*(connect(i) for i in range(start, min(start + 500, args.idle_clients))))
+    connect_seconds = time.perf_counter() - connect_started
+    await asyncio.sleep(2)
+    after = rss_bytes(server_pid)
+    await asyncio.gather(*(ws.close() for ws in connections), return_exceptions=True)
+    return dict(
+        clients=len(connections),
+        connect_errors=errors,
+        connect_seconds=round(connect_seconds, 3),
+        rss_before_bytes=before,
+        rss_after_bytes=after,
+        bytes_per_connection=round((after - before) / len(connections)) if connections and before and after else None,
+    )
+
+
+async def run_all(args):
+    workdir = tempfile.mkdtemp(prefix="supportchat-bench-")
+    os.makedirs(os.path.join(workdir, "uploads"))
+    os.makedirs(os.path.join(workdir, "app", "static"))
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    env = {
+        "SQLALCHEMY_DATABASE_URL": database_url,
+        "SEARCH_INDEX_PATH": os.path.join(workdir, "search.db"),
+        "BROKER_BACKEND": "unix" if args.workers > 1 else "memory",
+        "BROKER_SOCKET_PATH": os.path.join(workdir, "broker.sock"),
+        # All load comes from one IP, so the per-IP limits would measure themselves.
+        "LOGIN_RATE": "0",
+        "WS_IP_CONNECT_RATE": "0",
+    }
+    tokens = seed(env, args)
+    port = free_port()
+    base_url, ws_url = f"http://127.0.0.1:{port}", f"ws://127.0.0.1:{port}"
+    server = start_server(env, port, args.workers, workdir, args.ws_deflate)
+    results = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "database": database_url.split("://", 1)[0],
+        "scenarios": {},
+    }
+    try:
+        await wait_ready(base_url)
+        results["rss_idle_bytes"] = rss_bytes(server.pid)
+        scenarios = {
+            "login": lambda: bench_login(base_url, args),
+            "history": lambda: bench_history(base_url, args, tokens),
+            "websocket": lambda: bench_websockets(ws_url, args, tokens),
+            "idle": lambda: bench_idle(ws_url, args, tokens, server.pid),
+        }
+        for name in args.scenarios:
+            print(f"running {name}...", file=sys.stderr)
+            results["scenarios"][name] = await scenarios[name]()
+            results["scenarios"][name]["rss_bytes"] = rss_bytes(server.pid)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="defaults to a fresh SQLite file")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--tickets", type=int, default=100)
+    parser.add_argument("--history", type=int, default=20000, help="messages seeded before the run")
+    parser.add_argument("--clients", type=int, default=1000, help="concurrent WebSocket clients")
+    parser.add_argument("--sender-ratio", type=int, default=10, help="percent of clients that send")
+    parser.add_argument("--rate", type=float, default=2.0, help="frames per second per sender")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent REST requests")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("--scenarios", nargs="+", default=["login", "history", "websocket"],
+                        choices=["login", "history", "websocket", "idle"])
+    parser.add_argument("--idle-clients", type=int, default=5000, help="sockets held open by the idle scenario")
+    parser.add_argument("--no-ws-deflate", dest="ws_deflate", action="store_false",
+                        help="serve without permessage-deflate (roughly halves memory per idle socket)")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+    results = asyncio.run(run_all(args))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results["scenarios"], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Micro-benchmark for the list endpoints' read path.
+
+Seeds a throwaway SQLite database, then renders pages of ticket messages and
+tickets two ways and reports rows per second for each:
+
+    orm   ORM entities -> response model -> jsonable_encoder -> json.dumps
+          (what the endpoints did before app.core.serialize)
+    core  Core row tuples -> app.core.serialize (what they do now)
+
+Both produce the same bytes; the run checks that before timing.
+
+    python -m bench.serialize --rows 20000 --limit 200
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(engine, args):
+    from sqlalchemy import insert
+    from app.core.database import Base
+    from app.models import archive, delivery, id_block, message, read_state, stats, ticket, user  # noqa: F401
+
+    Base.metadata.create_all(engine)
+    now = datetime.now(timezone.utc)
+    with engine.begin() as conn:
+        conn.execute(insert(user.User), [
+            {"id": i, "name": f"user{i}", "email": f"user{i}@bench.local", "role": "user", "password_hash": "x"}
+            for i in (1, 2)
+        ])
+        conn.execute(insert(ticket.Ticket), [
+            {"id": i, "title": f"ticket {i}", "description": "benchmark ticket", "status": "OPEN",
+             "priority": "NORMAL", "creator_id": 1, "assignee_id": 2 if i % 2 else None,
+             "created_at": now - timedelta(seconds=i)}
+            for i in range(1, args.rows + 1)
+        ])
+        rows = [
+            {"id": i, "sender_id": 1 + i % 2, "receiver_id": None, "ticket_id": 1,
+             "content": f"history message {i}", "timestamp": now + timedelta(microseconds=i), "read": bool(i % 3)}
+            for i in range(1, args.rows + 1)
+        ]
+        for start in range(0, len(rows), 5000):
+            conn.execute(insert(message.Message), rows[start:start + 5000])
+
+
+def renderers(limit):
+    from fastapi.encoders import jsonable_encoder
+    from sqlalchemy import select
+    from app.core.serialize import dumps, rows_response
+    from app.models.message import Message
+    from app.models.ticket import Ticket
+    from app.routers.message import READ_COLUMNS, READ_FIELDS
+    from app.routers.ticket import TICKET_LIST_COLUMNS, TICKET_READ_FIELDS, TicketRead
+    from app.schemas.message import MessageRead
+
+    def encode(models):
+        # FastAPI's JSONResponse rendering of a response_model result.
+        return json.dumps(jsonable_encoder(models), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+    ticket_order = (Ticket.created_at.desc(), Ticket.id.desc())
+
+    def messages_orm(db):
+        messages = db.query(Message).filter(Message.ticket_id == 1).order_by(Message.id.desc()).limit(limit).all()
+        return encode([MessageRead.from_orm(m) for m in messages])
+
+    def messages_core(db):
+        rows = db.execute(select(*READ_COLUMNS).where(Message.ticket_id == 1).order_by(
+            Message.id.desc()
+        ).limit(limit)).all()
+        return dumps([dict(zip(READ_FIELDS, row)) for row in rows])
+
+    def tickets_orm(db):
+        tickets = db.query(Ticket).order_by(*ticket_order).limit(limit).all()
+        return encode([TicketRead(**{field: getattr(t, field) for field in TICKET_READ_FIELDS}) for t in tickets])
+
+    def tickets_core(db):
+        rows = db.execute(select(*TICKET_LIST_COLUMNS).order_by(*ticket_order).limit(limit)).all()
+        return rows_response(TICKET_READ_FIELDS, rows).body
+
+    return {"messages": (messages_orm, messages_core), "tickets": (tickets_orm, tickets_core)}
+
+
+def measure(session_factory, render, duration):
+    rows = pages = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        db = session_factory()
+        try:
+            body = render(db)
+        finally:
+            db.close()
+        rows += body.count(b'"id":')
+        pages += 1
+    elapsed = time.perf_counter() - started
+    return {"pages": pages, "rows": rows, "rows_per_sec": round(rows / elapsed), "ms_per_page": round(elapsed / pages * 1000, 3)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000, help="messages and tickets seeded")
+    parser.add_argument("--limit", type=int, default=200, help="rows per page")
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds per measurement")
+    parser.add_argument("--output", help="also write the results here as JSON")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench-serialize-")
+    os.environ["SQLALCHEMY_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    sys.path.insert(0, REPO_ROOT)
+    from app.core import serialize
+    from app.core.database import SessionLocal, engine
+
+    seed(engine, args)
+    results = {"encoder": "orjson" if serialize.orjson is not None else "json", "limit": args.limit, "endpoints": {}}
+    for name, (orm, core) in renderers(args.limit).items():
+        db = SessionLocal()
+        try:
+            if orm(db) != core(db):
+                raise SystemExit(f"{name}: ORM and Core bodies differ")
+        finally:
+            db.close()
+        print(f"running {name}...", file=sys.stderr)
+        before = measure(SessionLocal, orm, args.duration)
+        after = measure(SessionLocal, core, args.duration)
+        results["endpoints"][name] = {
+            "orm": before, "core": after, "speedup": round(after["rows_per_sec"] / before["rows_per_sec"], 2),
+        }
+    engine.dispose()
+    shutil.rmtree(workdir, ignore_errors=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()